@@ -1,9 +1,11 @@
-from base64 import b64decode
+from json import dump, load as json_load
 import logging
 from pathlib import Path
 from pwd import getpwnam, getpwuid
-from subprocess import check_output
-from os import environ, geteuid
+from time import perf_counter
+from os import environ, geteuid, getpid, listdir, replace, stat
+
+from . import load_config
 
 
 class NetkitError(RuntimeError):
@@ -22,21 +24,170 @@ logging.basicConfig(format="[%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
 
+launched_pids = set()  # Processes started in the background by this process, rescanned once by the next refresh.
+
+
+# The start time of a process in clock ticks since boot, which tells a process apart from an earlier one with its pid.
+def process_start_time(pid):
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            return int(f.read().rsplit(b")", 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+# A snapshot of /proc, indexing the umids, hubs and open files (by inode) of each process.
+class ProcSnapshot:
+    def __init__(self, cmdlines=True, fds=True):
+        self.cmdlines = cmdlines
+        self.fds = fds
+        self.hub_socket_directory = f"{config['HUB_SOCKET_DIR']}/"
+        self.processes = {}  # pid -> (uid, umids, inodes, hubs)
+        self.start_times = {}  # pid -> start time
+        self.umids = {}  # umid -> pids
+        self.hubs = {}  # hub socket -> pids
+        self.inodes = {}  # (st_dev, st_ino) -> pids
+        self.refresh()
+
+    def scan(self, pid):
+        directory = f"/proc/{pid}"
+        umids = ()
+        inodes = ()
+        hubs = ()
+
+        start_time = process_start_time(pid)
+        if start_time is None:  # The process has exited.
+            return
+
+        try:
+            uid = stat(directory).st_uid
+
+            if self.cmdlines:
+                with open(f"{directory}/cmdline", "rb") as f:
+                    tokens = f.read().decode(errors="replace").replace("\0", " ").split()
+
+                # Machines name their hubs in ethN=daemon,,,<socket> and hubs are given their socket as an argument.
+                umids = tuple({token[5:] for token in tokens if token.startswith("umid=")})
+                hubs = tuple({token.split(",")[-1] for token in tokens if token.split(",")[-1].startswith(self.hub_socket_directory)})
+
+            if self.fds:
+                inodes = set()
+                try:
+                    for fd in listdir(f"{directory}/fd"):
+                        try:
+                            fd_stat = stat(f"{directory}/fd/{fd}")
+                            inodes.add((fd_stat.st_dev, fd_stat.st_ino))
+                        except OSError:
+                            pass
+                except PermissionError:
+                    pass
+        except OSError:  # The process has exited.
+            return
+
+        self.processes[pid] = (uid, umids, inodes, hubs)
+        self.start_times[pid] = start_time
+        for index, keys in ((self.umids, umids), (self.inodes, inodes), (self.hubs, hubs)):
+            for key in keys:
+                index.setdefault(key, set()).add(pid)
+
+    def forget(self, pid):
+        _, umids, inodes, hubs = self.processes.pop(pid)
+        del self.start_times[pid]
+        for index, keys in ((self.umids, umids), (self.inodes, inodes), (self.hubs, hubs)):
+            for key in keys:
+                index[key].discard(pid)
+                if len(index[key]) == 0:
+                    del index[key]
+
+    # Drops exited processes and scans new ones, along with those in pids and those we have started since the last refresh.
+    def refresh(self, pids=()):
+        current = {int(name) for name in listdir("/proc") if name.isdigit()}
+
+        for pid in tuple(self.processes):
+            if pid not in current or pid in pids or pid in launched_pids:
+                self.forget(pid)
+
+        launched_pids.clear()
+
+        for pid in current:
+            if pid not in self.processes:
+                self.scan(pid)
+
+    # Rescans those of the given pids that have been reused since they were scanned. Returns those that were not.
+    def validate(self, pids):
+        valid = set()
+        for pid in tuple(pids):
+            if process_start_time(pid) == self.start_times[pid]:
+                valid.add(pid)
+            else:
+                self.forget(pid)
+                self.scan(pid)
+
+        return valid
+
+    # All the processes of a machine: its kernel's processes and any terminal wrapping it.
+    def pids(self, vhost, uid=None):
+        return {pid for pid in self.validate(self.umids.get(vhost, ())) if uid is None or self.processes[pid][0] == uid}
+
+    def pid(self, vhost, uid=None):
+        pids = self.pids(vhost, uid)
+        return min(pids) if len(pids) != 0 else None
+
+    def in_use(self, path):
+        try:
+            path_stat = stat(path)
+        except OSError:
+            return False
+
+        return len(self.validate(self.inodes.get((path_stat.st_dev, path_stat.st_ino), ()))) != 0
+
+
+proc_snapshot_ = None
+
+
+# Returns a snapshot of /proc shared by the whole process. It is refreshed each time it is requested.
+def proc_snapshot():
+    global proc_snapshot_
+
+    if proc_snapshot_ is None:
+        proc_snapshot_ = ProcSnapshot()
+    else:
+        proc_snapshot_.refresh()
+
+    return proc_snapshot_
+
+
 # Determines if a file is in use by another process.
-def in_use(path):
-    path = path.resolve()
+def in_use(path, snapshot=None):
+    if snapshot is None:
+        snapshot = proc_snapshot()
 
-    for candidate in Path("/proc").iterdir():
-        if candidate.name.isdigit() and candidate.is_dir():
-            candidate /= "fd"
-            try:
-                for candidate_ in candidate.iterdir():
-                    if path == candidate_.resolve():
-                        return True
-            except PermissionError:
-                pass
+    return snapshot.in_use(path)
 
-    return False
+
+def cache_file(name):
+    return Path(environ["HOME"]) / ".netkit" / "cache" / name
+
+
+# Reads a JSON cache file, returning None if it is missing or unreadable.
+def read_cache(file):
+    try:
+        with file.open() as f:
+            return json_load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Atomically writes a JSON cache file. Failures are not fatal as the cache is only an optimisation.
+def write_cache(file, data):
+    try:
+        file.parent.mkdir(parents=True, exist_ok=True)
+        temporary = file.with_name(f"{file.name}.{getpid()}.tmp")
+        with temporary.open("w") as f:
+            dump(data, f)
+        replace(temporary, file)
+    except OSError as e:
+        logger.info(f"Unable to write the cache file {file}: {e}")
 
 
 def optional(string):
@@ -47,15 +198,14 @@ def optional(string):
 
 
 # Determines the pid of a running lab.
-def pid(vhost, user=None):
+def pid(vhost, user=None, snapshot=None):
     if user is not None:
         user = getpwnam(user).pw_uid
 
-    for candidate in Path("/proc").iterdir():
-        if candidate.name.isdigit() and candidate.is_dir() and (user is None or candidate.stat().st_uid == user):
-            candidate /= "cmdline"
-            if candidate.is_file() and f"umid={vhost} " in candidate.read_text():
-                return int(candidate.parent.name)
+    if snapshot is None:
+        snapshot = proc_snapshot()
+
+    return snapshot.pid(vhost, user)
 
 
 def resolved_file(string):
@@ -85,52 +235,96 @@ def unsigned_integer(string):
     return integer
 
 
+# A number of simultaneous machines, where 0 is unlimited, or "auto" to adapt it to the pressure on the host.
+def concurrency(string):
+    return "auto" if string == "auto" else unsigned_integer(string)
+
+
 def verbose(verbose_):
     if verbose_:
         logger.setLevel(level=logging.INFO)
 
 
-netkit_python_home = resolved_file(__file__).parent
+def yes(string):
+    return string == "yes"
+
+
+def directory(string):
+    return Path(string).resolve()
+
+
+# How each configuration value is converted. Directories do not have to exist but files do.
+CONVERSIONS = {
+    **{key: int for key in ("VM_MEMORY", "VM_MEMORY_SKEW", "MAX_INTERFACES", "MIN_MEM", "MAX_MEM", "MEMORY_HEADROOM", "GRACE_TIME", "PREWARM_BUDGET", "UPDATE_CHECK_PERIOD")},
+    "MAX_SIMULTANEOUS_VMS": concurrency,
+    **{key: yes for key in ("CON0_PORTHELPER", "USE_SUDO", "TMUX_OPEN_TERMS", "CHECK_FOR_UPDATES")},
+    **{key: directory for key in ("MCONSOLE_DIR", "HUB_SOCKET_DIR")},
+    **{key: resolved_file for key in ("VM_MODEL_FS", "VM_KERNEL")},
+    **{key: optional for key in ("VM_CON0", "VM_CON1")},
+}
+
+
+# The Netkit configuration. It is loaded, and each value converted, only when first used.
+class Config:
+    def __init__(self):
+        self.values = None
+        self.converted = {}
+        self.load_time = None
+
+    def load(self):
+        if self.values is None:
+            start_time = perf_counter()
+            self.values = load_config.load(netkit_home_())
+            self.load_time = perf_counter() - start_time
+
+        return self.values
+
+    def __getitem__(self, key):
+        if key not in self.converted:
+            value = self.load()[key]
+            self.converted[key] = CONVERSIONS[key](value) if key in CONVERSIONS else value
+
+        return self.converted[key]
+
+    def __contains__(self, key):
+        return key in self.load()
+
+    def keys(self):
+        return self.load().keys()
+
+
+config = Config()
+netkit_python_home = Path(__file__).resolve().parent
+
 
 # Get the Netkit home from NETKIT_HOME or the legacy VLAB_HOME.
-netkit_home = None
-for environment_variable in ("NETKIT_HOME", "VLAB_HOME"):
-    try:
-        netkit_home = resolved_directory(environ[environment_variable])
-        break
-    except KeyError:
-        pass
+def netkit_home_():
+    for environment_variable in ("NETKIT_HOME", "VLAB_HOME"):
+        if environment_variable in environ:
+            return resolved_directory(environ[environment_variable])
 
-if netkit_home is None:
     raise NetkitError("The NETKIT_HOME environment variable is not properly set.")
 
-# Load the configuration. To reduce complexity a shell script is used.
-config = {}
-for line in check_output(("/bin/sh", netkit_python_home / "load_config.sh", netkit_home)).decode().split("\n"):
-    line = line.strip().split()
 
-    if len(line) >= 2:
-        config[line[0]] = b64decode(line[1]).decode()[:-1]  # Strip out the "\n" appended by echo.
+def config_load_time_():
+    config.load()
+    return config.load_time
 
-# Convert integer arguments.
-for key in ("VM_MEMORY", "VM_MEMORY_SKEW", "MAX_INTERFACES", "MIN_MEM", "MAX_MEM", "MAX_SIMULTANEOUS_VMS", "GRACE_TIME", "UPDATE_CHECK_PERIOD"):
-    config[key] = int(config[key])
 
-# Convert boolean arguments.
-for key in ("CON0_PORTHELPER", "USE_SUDO", "TMUX_OPEN_TERMS", "CHECK_FOR_UPDATES"):
-    config[key] = config[key] == "yes"
+LAZY = {
+    "netkit_home": netkit_home_,
+    "config_load_time": config_load_time_,
+    "user_id": lambda: getpwuid(geteuid()).pw_name,
+    "home": lambda: resolved_directory(environ["HOME"]),
+}
 
-# Convert directory arguments. They do not have to exist.
-for key in ("MCONSOLE_DIR", "HUB_SOCKET_DIR"):
-    config[key] = Path(config[key]).resolve()
 
-# Convert file arguments. These should exist.
-for key in ("VM_MODEL_FS", "VM_KERNEL"):
-    config[key] = resolved_file(config[key])
+# Evaluates netkit_home, config_load_time, user_id and home when they are first used.
+def __getattr__(name):
+    if name not in LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Convert optionals.
-for key in ("VM_CON0", "VM_CON1"):
-    config[key] = optional(config[key])
+    value = LAZY[name]()
+    globals()[name] = value
 
-user_id = getpwuid(geteuid()).pw_name
-home = resolved_directory(environ["HOME"])
+    return value
@@ -0,0 +1,78 @@
+from ctypes import CDLL, get_errno
+from functools import lru_cache
+from os import O_CLOEXEC, O_NONBLOCK, close, fsdecode, fsencode, read, strerror
+from struct import Struct
+
+from . import common
+
+# Ensure the script is not being run independently.
+if __name__ == "__main__":
+    raise common.NetkitError("This script is not intended for standalone use.")
+
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+EVENT = Struct("iIII")
+
+
+# The C library is loaded on first use, from the symbols of the running process.
+@lru_cache(maxsize=None)
+def libc():
+    try:
+        libc_ = CDLL(None, use_errno=True)
+        libc_.inotify_init1
+        libc_.inotify_add_watch
+        return libc_
+    except (AttributeError, OSError):
+        return None
+
+
+def available():
+    return libc() is not None
+
+
+# A minimal inotify instance. The file descriptor is non-blocking so it can be used with select-like functions.
+class Inotify:
+    def __init__(self):
+        if libc() is None:
+            raise OSError("inotify is not available.")
+
+        self.fd = libc().inotify_init1(O_NONBLOCK | O_CLOEXEC)
+        if self.fd < 0:
+            errno = get_errno()
+            raise OSError(errno, strerror(errno))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        wd = libc().inotify_add_watch(self.fd, fsencode(str(path)), mask)
+        if wd < 0:
+            errno = get_errno()
+            raise OSError(errno, strerror(errno), str(path))
+
+        return wd
+
+    # Returns a list of (wd, mask, name) for all pending events.
+    def read(self):
+        events = []
+        while True:
+            try:
+                buffer = read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT.unpack_from(buffer, offset)
+                offset += EVENT.size
+                name = fsdecode(buffer[offset:offset + length].split(b"\0", 1)[0])
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        if self.fd >= 0:
+            close(self.fd)
+            self.fd = -1
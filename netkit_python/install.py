@@ -17,7 +17,7 @@ for source_file in source_directory.iterdir():
 
 print("Making wrapper scripts:")
 wrapper_directory = common.netkit_home / "bin"
-for wrapper in ("lstart",):
+for wrapper in ("lstart", "lhalt", "lcrash", "lstatus", "lsnapshot", "lrestore"):
     wrapper_file = wrapper_directory / f"python-{wrapper}"
     print(f"  Making: {wrapper_file}")
     wrapper_file.unlink(missing_ok=True)
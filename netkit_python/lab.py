@@ -0,0 +1,199 @@
+from argparse import Namespace
+from asyncio import TimeoutError, create_task, gather, get_running_loop, shield, wait_for
+import os
+from signal import SIGKILL
+
+from . import common, lcommon, lschedule, lshutdown, lsignature, lstart, lstatus, lsupervisor, mconsole, vstart
+from .lcommon import DependencyError, MachineError, NotRunningError, ReadyTimeout, StartError, StopError
+
+__all__ = ("Lab", "MachineError", "NotRunningError", "StartError", "DependencyError", "ReadyTimeout", "StopError")
+
+# Ensure the script is not being run independently.
+if __name__ == "__main__":
+    raise common.NetkitError("This script is not intended for standalone use.")
+
+
+# A Netkit lab driven from asyncio. start and stop return a future or task per machine.
+class Lab:
+    def __init__(self, directory, passthrough=(), switch_daemon=False):
+        self.directory = common.resolved_directory(directory)
+        self.passthrough = list(passthrough)
+        self.switch_daemon = switch_daemon
+        self.vhosts = lcommon.vhost_list(Namespace(directory=self.directory, vhost_list=[]))
+        self.dependency_graph = lcommon.lab_dependency_graph(self.directory, self.vhosts)
+        lschedule.check_acyclic(self.dependency_graph)
+
+        self.starting = {}  # vhost -> the future of its latest start.
+        self.tasks = set()  # Starts and hub clean ups still running.
+        self.watcher = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.close()
+
+    def check(self, vhosts):
+        vhosts = self.vhosts if vhosts is None else list(vhosts)
+        for vhost in vhosts:
+            if vhost not in self.dependency_graph:
+                raise MachineError(vhost, f"Machine {vhost} is not part of the lab in {self.directory}.")
+
+        return vhosts
+
+    def background(self, coroutine):
+        task = create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # Launches a host without waiting for it to boot, like lstart but without printing.
+    def launch(self, spec, vstart_arguments, arguments, snapshot=None):
+        (self.directory / f"{spec.vhost}.ready").unlink(missing_ok=True)
+        return vstart.launch(spec, vstart_arguments, hubs=False, snapshot=snapshot, detach_helpers=False)
+
+    # Returns the status of each machine, as shown by lstatus.
+    def status(self, vhosts=None):
+        return lstatus.LabStatus(self.directory, self.check(vhosts)).collect()
+
+    # Starts machines and their dependencies, returning a future per machine. Running machines are only waited for.
+    def start(self, vhosts=None, max_processes=0, grace_time=0, ready_timeout=None):
+        loop = get_running_loop()
+        dependency_graph = lcommon.lab_dependency_graph(self.directory, self.check(vhosts))
+
+        # Machines this Lab has started are ready, as their ready files have been removed. Starts still under way are awaited.
+        started = {vhost for vhost, future in self.starting.items() if future.done() and not future.cancelled() and future.exception() is None}
+        awaiting = {vhost: self.starting[vhost] for vhost in dependency_graph if vhost in self.starting and not self.starting[vhost].done()}
+        statuses = [status for status in lstatus.LabStatus(self.directory, list(dependency_graph)).collect() if status["running"]]
+        ready = {status["vhost"] for status in statuses if status["ready"] or status["vhost"] in started}
+        booting = {status["vhost"]: status["pid"] for status in statuses if status["vhost"] not in ready and status["vhost"] not in awaiting}
+
+        futures = {vhost: loop.create_future() for vhost in dependency_graph}
+        for vhost in ready:
+            futures[vhost].set_result(None)
+
+        # Dependencies that are already ready are satisfied.
+        dependency_graph = {vhost: [dependency for dependency in dependencies if dependency not in ready] for vhost, dependencies in dependency_graph.items() if vhost not in ready}
+        if len(dependency_graph) == 0:
+            return futures
+
+        arguments = Namespace(directory=self.directory, passthrough=self.passthrough, verbose=False, fast_mode=False, grace_time=grace_time, switch_daemon=self.switch_daemon)
+        specs = lstart.prepare_all([vhost for vhost in dependency_graph if vhost not in booting and vhost not in awaiting], arguments)
+
+        timings = lcommon.Timings()
+        weights = lschedule.weights(dependency_graph, lcommon.boot_times(lcommon.load_timings(self.directory)))
+        scheduler = lschedule.Scheduler(dependency_graph, lschedule.priorities(dependency_graph, weights))
+        admission = lschedule.MemoryAdmission({vhost: specs[vhost][0].memory + common.config["VM_MEMORY_SKEW"] if vhost in specs else 0 for vhost in dependency_graph}, common.config["MEMORY_HEADROOM"])
+        controller = lschedule.PressureController() if max_processes == "auto" else None
+        supervisor = lsupervisor.Supervisor(arguments, timings, scheduler, admission, specs, 0 if controller is not None else max_processes, self.launch, controller, {vhost: futures[vhost] for vhost in dependency_graph}, ready_timeout, booting, awaiting)
+
+        for vhost in dependency_graph:
+            self.starting[vhost] = futures[vhost]
+
+        async def run():
+            try:
+                # Starting the hubs blocks until their sockets appear.
+                try:
+                    await loop.run_in_executor(None, lstart.start_hubs, specs, arguments)
+                except Exception as e:
+                    for vhost in dependency_graph:
+                        supervisor.settle(vhost, StartError(vhost, f"{vhost} was not started because the hubs could not be started: {e}"))
+                    return
+
+                await supervisor.run()
+            finally:
+                timings.save(self.directory)
+
+                started = {vhost: specs[vhost] for vhost in specs if futures[vhost].done() and not futures[vhost].cancelled() and futures[vhost].exception() is None}
+                signatures = lsignature.Signatures(self.directory)
+                signatures.save(signatures.signatures(started))
+
+        self.background(run())
+
+        return futures
+
+    # Waits for a machine to be ready. Raises NotRunningError if it isn't running, or ReadyTimeout.
+    async def ready(self, vhost, timeout=None):
+        self.check((vhost,))
+
+        try:
+            if vhost in self.starting:
+                await wait_for(shield(self.starting[vhost]), timeout)
+                return
+
+            status = lstatus.LabStatus(self.directory, [vhost]).collect()[0]
+            if not status["running"]:
+                raise NotRunningError(vhost, f"{vhost} is not running.")
+
+            if not status["ready"]:
+                if self.watcher is None:
+                    self.watcher = lsupervisor.AsyncReadyWatcher(self.directory)
+
+                await wait_for(self.watcher.ready(vhost), timeout)
+        except TimeoutError:
+            raise ReadyTimeout(vhost, f"{vhost} did not become ready within {timeout} seconds.")
+
+    # Stops machines, dependants first unless crashing, killing them after timeout seconds. Returns a task per machine.
+    def stop(self, vhosts=None, crash=False, timeout=None):
+        vhosts = self.check(vhosts)
+        command = "halt" if crash else "cad"
+        timeout = (5 if crash else 120) if timeout is None else timeout
+
+        snapshot = common.ProcSnapshot(fds=False)
+        pids = {vhost: snapshot.pids(vhost, os.geteuid()) for vhost in vhosts}
+        hubs = {hub for vhost_pids in pids.values() for pid in vhost_pids for hub in snapshot.processes[pid][3]}
+
+        dependants = {vhost: [] for vhost in vhosts}
+        if not crash:
+            for dependant, dependencies in lcommon.lab_dependency_graph(self.directory, vhosts).items():
+                for dependency in dependencies:
+                    if dependency in dependants and dependant in dependants:
+                        dependants[dependency].append(dependant)
+
+        lschedule.check_acyclic(dependants)
+
+        async def stop(vhost):
+            await gather(*(tasks[dependant] for dependant in dependants[vhost]), return_exceptions=True)
+
+            if len(pids[vhost]) == 0:
+                return False
+
+            self.starting.pop(vhost, None)
+
+            client = mconsole.Mconsole()
+            try:
+                ok, output = (await get_running_loop().run_in_executor(None, client.batch, ((vhost, command),), min(timeout, 5)))[0]
+            finally:
+                client.close()
+
+            if not ok:
+                common.logger.info(f"{vhost}: {output}")
+
+            try:
+                await wait_for(gather(*(lsupervisor.exited(pid) for pid in pids[vhost])), timeout)
+            except TimeoutError:
+                common.logger.warning(f"{vhost} did not shut down within {timeout} seconds. Killing it.")
+                lshutdown.kill(pids[vhost], SIGKILL)
+                try:
+                    await wait_for(gather(*(lsupervisor.exited(pid) for pid in pids[vhost])), 5)
+                except TimeoutError:
+                    raise StopError(vhost, f"{vhost} could not be killed.")
+
+            return True
+
+        tasks = {vhost: create_task(stop(vhost)) for vhost in vhosts}  # The tasks only start once this returns.
+
+        async def stop_unused_hubs():
+            await gather(*tasks.values(), return_exceptions=True)
+            lshutdown.stop_unused_hubs(hubs, snapshot, [pid for vhost_pids in pids.values() for pid in vhost_pids])
+
+        self.background(stop_unused_hubs())
+
+        return tasks
+
+    # Waits for the starts and hub clean ups still running. The machines are left running.
+    async def close(self):
+        await gather(*self.tasks, return_exceptions=True)
+
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
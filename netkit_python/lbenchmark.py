@@ -0,0 +1,228 @@
+from argparse import ArgumentParser
+from os import environ, kill, listdir, pathsep
+from pathlib import Path
+from signal import SIGKILL
+from subprocess import DEVNULL, PIPE, run
+from sys import executable
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import perf_counter
+
+# A benchmark of lstart on synthetic labs, with stub kernels and uml_switches.
+
+# The stub kernel keeps its arguments, so it can be found by its umid, and holds its disk open like a kernel.
+STUB_KERNEL = """#!{executable}
+import sys, time
+from pathlib import Path
+arguments = dict(argument.split("=", 1) for argument in sys.argv[1:] if "=" in argument)
+disk = open(arguments["ubd0"].split(",")[0], "ab")
+time.sleep({delay})
+(Path(arguments["hostlab"]) / f"{arguments['name']}.ready").touch()
+time.sleep({lifetime})
+"""
+
+STUB_SWITCH = """#!{executable}
+import socket, sys, time
+hub = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+hub.bind(sys.argv[sys.argv.index("-unix") + 1])
+hub.listen()
+time.sleep({lifetime})
+"""
+
+SHAPES = ("chain", "tree", "wide")
+CLIS = ("lstart", "vstart", "lhalt", "lcrash", "lstatus", "lsnapshot", "lrestore")
+IMPORT_BUDGET = 100  # Milliseconds.
+
+
+# Creates a Netkit home containing the stub kernel, an empty model file system and the stub uml_switch.
+def make_netkit_home(directory, delay, lifetime):
+    (directory / "kernel").mkdir(parents=True)
+    (directory / "fs").mkdir()
+    (directory / "bin").mkdir()
+
+    kernel = directory / "kernel" / "netkit-kernel"
+    kernel.write_text(STUB_KERNEL.replace("{executable}", executable).replace("{delay}", str(delay)).replace("{lifetime}", str(lifetime)))
+    kernel.chmod(0o755)
+
+    (directory / "fs" / "netkit-fs").touch()
+
+    switch = directory / "bin" / "uml_switch"
+    switch.write_text(STUB_SWITCH.replace("{executable}", executable).replace("{lifetime}", str(lifetime)))
+    switch.chmod(0o755)
+
+
+# Creates a lab of size hosts shaped as a chain, a binary tree or a wide lab. Every four hosts share a collision domain.
+def make_lab(directory, size, shape):
+    directory.mkdir(parents=True)
+
+    vhosts = [f"h{i}" for i in range(size)]
+    conf = [f"machines=\"{' '.join(vhosts)}\""]
+    dep = []
+    for i, vhost in enumerate(vhosts):
+        conf.append(f"{vhost}[0]=D{i // 4}")
+        conf.append(f"{vhost}[con0]=none")
+
+        if shape == "chain" and i > 0:
+            dep.append(f"{vhost}: h{i - 1}")
+        elif shape == "tree" and i > 0:
+            dep.append(f"{vhost}: h{(i - 1) // 2}")
+
+    (directory / "lab.conf").write_text("\n".join(conf) + "\n")
+    (directory / "lab.dep").write_text("\n".join(dep) + "\n")
+
+
+def process_count():
+    return sum(1 for name in listdir("/proc") if name.isdigit())
+
+
+# Samples the number of processes on the host until stopped, keeping the peak.
+class ProcessCounter(Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stopped = Event()
+        self.baseline = process_count()
+        self.peak = self.baseline
+
+    def run(self):
+        while not self.stopped.wait(0.05):
+            self.peak = max(self.peak, process_count())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+# Kills every process whose command line mentions the benchmark directory, i.e. the stub kernels and switches.
+def kill_stubs(directory):
+    marker = str(directory).encode()
+    for name in listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/cmdline", "rb") as f:
+                    if marker in f.read():
+                        kill(int(name), SIGKILL)
+            except OSError:
+                pass
+
+
+def benchmark(directory, size, shape, parallel, delay):
+    from . import common, lcommon
+
+    lab = directory / f"{shape}-{size}"
+    make_lab(lab, size, shape)
+
+    counter = ProcessCounter()
+    counter.start()
+    start_time = perf_counter()
+    result = run((executable, "-m", "netkit_python.lstart", "-d", str(lab), "-p", str(parallel)), cwd=lab, stdout=DEVNULL)
+    makespan = perf_counter() - start_time
+
+    scan_start = perf_counter()
+    common.ProcSnapshot()
+    scan_time = perf_counter() - scan_start
+
+    counter.stop()
+    kill_stubs(directory)
+
+    if result.returncode != 0:
+        raise common.NetkitError(f"lstart failed for the {shape} lab of {size} machines.")
+
+    record = lcommon.load_timings(lab)[-1]
+    overheads = [phases["launch"] + phases.get("boot", delay) - delay for phases in record["vhosts"].values()]
+
+    return {
+        "shape": shape,
+        "size": size,
+        "makespan": makespan,
+        "overhead": sum(overheads) / len(overheads),
+        "hubs": record["lab"].get("hubs", 0),
+        "proc_scan": scan_time,
+        "peak_processes": counter.peak - counter.baseline,
+    }
+
+
+# The best import time of a command over several runs, in milliseconds.
+def import_time(cli, runs=5):
+    import_times = []
+    for _ in range(runs):
+        output = run((executable, "-X", "importtime", "-c", f"import netkit_python.{cli}"), stdout=DEVNULL, stderr=PIPE).stderr.decode()
+        for line in output.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == f"netkit_python.{cli}":
+                import_times.append(int(fields[1]) / 1000)
+
+    return min(import_times)
+
+
+# The best import time and --help wall time of a command over several runs.
+def startup_time(cli, runs=5):
+    help_times = []
+    for _ in range(runs):
+        start_time = perf_counter()
+        run((executable, "-m", f"netkit_python.{cli}", "--help"), stdout=DEVNULL)
+        help_times.append((perf_counter() - start_time) * 1000)
+
+    return import_time(cli, runs), min(help_times)
+
+
+# Checks the import time of every command against a budget, in milliseconds.
+def check_startup(budget):
+    from . import common
+
+    print(f"{'COMMAND':<10} {'IMPORT':>9} {'--HELP':>9}")
+    over_budget = []
+    for cli in CLIS:
+        import_time, help_time = startup_time(cli)
+        print(f"{cli:<10} {import_time:>7.1f}ms {help_time:>7.1f}ms", flush=True)
+
+        if import_time > budget:
+            over_budget.append(cli)
+
+    if len(over_budget) != 0:
+        raise common.NetkitError(f"Importing {', '.join(over_budget)} took longer than the budget of {budget} ms.")
+
+
+def main(arguments=None):
+    parser = ArgumentParser(prog="lbenchmark", description="Benchmarks lstart on synthetic labs with stub kernels and hubs.")
+
+    parser.add_argument("-n", "--sizes", nargs="+", default=[10, 100], type=int, metavar="SIZE", dest="sizes")
+    parser.add_argument("-s", "--shapes", nargs="+", default=list(SHAPES), choices=SHAPES, metavar="SHAPE", dest="shapes")
+    parser.add_argument("-p", default="0", metavar="VALUE", dest="parallel")  # Passed to lstart, which accepts "auto".
+    parser.add_argument("--delay", default=0.1, type=float, metavar="SECONDS", dest="delay")
+    parser.add_argument("--lifetime", default=30, type=float, metavar="SECONDS", dest="lifetime")
+    parser.add_argument("--import-budget", default=IMPORT_BUDGET, type=float, metavar="MILLISECONDS", dest="import_budget")
+    parser.add_argument("--startup-only", action="store_true", dest="startup_only")
+
+    arguments = parser.parse_args(args=arguments)
+
+    with TemporaryDirectory(prefix="netkit-benchmark-") as directory:
+        directory = Path(directory)
+        make_netkit_home(directory / "netkit", arguments.delay, arguments.lifetime)
+        (directory / "home" / ".netkit" / "hubs").mkdir(parents=True)
+        (directory / "home" / ".netkit" / "mconsole").mkdir()
+
+        # The benchmark and the lstart processes it runs only see the stubs.
+        environ["NETKIT_HOME"] = str(directory / "netkit")
+        environ["HOME"] = str(directory / "home")
+        environ["PATH"] = f"{directory / 'netkit' / 'bin'}{pathsep}{environ['PATH']}"
+        environ["NETKIT_CON0"] = "none"
+        environ["NETKIT_CON1"] = "none"
+        environ["PYTHONPATH"] = f"{Path(__file__).resolve().parent.parent}{pathsep}{environ.get('PYTHONPATH', '')}"
+
+        check_startup(arguments.import_budget)
+        if arguments.startup_only:
+            return
+
+        print()
+        print(f"{'SHAPE':<6} {'SIZE':>5} {'MAKESPAN':>9} {'OVERHEAD':>9} {'HUBS':>7} {'PROC SCAN':>10} {'PEAK PROCS':>11}")
+        try:
+            for shape in arguments.shapes:
+                for size in arguments.sizes:
+                    result = benchmark(directory, size, shape, arguments.parallel, arguments.delay)
+                    print(f"{result['shape']:<6} {result['size']:>5} {result['makespan']:>8.3f}s {result['overhead']:>8.3f}s {result['hubs']:>6.3f}s {result['proc_scan']:>9.4f}s {result['peak_processes']:>11}", flush=True)
+        finally:
+            kill_stubs(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,167 @@
-from . import common
+from hashlib import sha1
+from re import compile
+from select import select
+from json import dumps, loads
+from os import getpid, replace
+from time import monotonic, time
+
+from . import common, inotify
 
 # Ensure the script is not being run independently.
 if __name__ == "__main__":
     raise common.NetkitError("This script is not intended for standalone use.")
 
+ASSIGNMENT = compile(r"([^\s\[\]=]+)\[([^\]]*)\]\s*=(.*)")
+TIMINGS_HISTORY = 100  # Runs kept in lab.timings.
+
+
+# An error concerning a single machine of a lab, whose name is vhost.
+class MachineError(common.NetkitError):
+    def __init__(self, vhost, message):
+        super().__init__(message)
+        self.vhost = vhost
+
+
+# A machine is not running.
+class NotRunningError(MachineError):
+    pass
+
+
+# A machine failed to start.
+class StartError(MachineError):
+    pass
+
+
+# A machine was not started because its dependency failed to start.
+class DependencyError(StartError):
+    def __init__(self, vhost, message, dependency):
+        super().__init__(vhost, message)
+        self.dependency = dependency
+
+
+# A machine did not become ready in time.
+class ReadyTimeout(StartError):
+    pass
+
+
+# A machine could not be stopped.
+class StopError(MachineError):
+    pass
+
+
+# The contents of a lab.conf file, parsed in a single pass.
+class LabConfig:
+    def __init__(self, machines=None, options=None, warnings=None):
+        self.machines = machines
+        self.options = {} if options is None else options  # vhost -> [(key, value)]
+        self.warnings = [] if warnings is None else warnings  # [(line number, message)]
+
+    @classmethod
+    def parse(cls, conf):
+        config = cls()
+        assigned = set()
 
-def lab_vhost_list(directory):
-    conf = directory / "lab.conf"
-    if conf.is_file():
         with conf.open() as f:
-            for line in f.readlines():
+            for number, line in enumerate(f, 1):
                 line = line.split("#")[0].strip()
+
                 if line.startswith("machines="):
-                    return line[9:].strip("\"").split()
+                    config.machines = line[9:].strip("\"").split()
+                    continue
+
+                match = ASSIGNMENT.fullmatch(line)
+                if match is None:
+                    continue
+
+                vhost = match.group(1)
+                key = match.group(2).strip()
+                value = match.group(3).strip()
+
+                if (vhost, key) in assigned:
+                    config.warnings.append((number, f"{vhost}[{key}] is assigned multiple times. Using the first assignment."))
+                    continue
+
+                assigned.add((vhost, key))
+
+                if " " in value:
+                    config.warnings.append((number, f"{vhost}[{key}]'s argument contains spaces. These will be removed."))
+                    value = value.replace(" ", "")
+
+                if key.isdigit():
+                    if not value.startswith("tap"):
+                        if "," in value or "." in value:
+                            config.warnings.append((number, f"{vhost}[{key}]'s argument contains commas or dots. These will be removed."))
+                            value = value.replace(",", "").replace(".", "")
+
+                    if "_" in value:
+                        config.warnings.append((number, f"{vhost}[{key}]'s argument contains underscores. These will be removed."))
+                        value = value.replace("_", "")
+
+                config.options.setdefault(vhost, []).append((key, value))
+
+        return config
+
+    # The options of a machine as (vstart option, value) pairs. The value is None for options without an argument.
+    def vstart_options(self, vhost):
+        for key, value in self.options.get(vhost, ()):
+            if key.isdigit():
+                option = f"--eth{key}"
+            elif key.startswith("append"):
+                option = "--append"
+            elif len(key) == 1:
+                option = f"-{key}"
+            else:
+                option = f"--{key}"
+
+            yield option, value if len(value) > 0 else None
+
+    # The collision domains of a machine as (interface number, domain) pairs.
+    def interfaces(self, vhost):
+        return [(int(key), value) for key, value in self.options.get(vhost, ()) if key.isdigit()]
+
+
+lab_configs = {}
+
+
+# Loads the lab.conf of a lab directory, or returns None if there isn't one. It is cached until it changes.
+def lab_config(directory):
+    conf = directory / "lab.conf"
+
+    try:
+        conf_stat = conf.stat()
+    except OSError:
+        return None
+
+    key = [str(conf), conf_stat.st_mtime_ns, conf_stat.st_size, conf_stat.st_ino]
+
+    if str(conf) in lab_configs and lab_configs[str(conf)][0] == key:
+        return lab_configs[str(conf)][1]
+
+    cache = common.cache_file(f"lab-{sha1(str(conf).encode()).hexdigest()}.json")
+    cached = common.read_cache(cache)
+    if isinstance(cached, dict) and cached.get("key") == key:
+        config = LabConfig(cached["machines"], {vhost: [tuple(option) for option in options] for vhost, options in cached["options"].items()}, [tuple(warning) for warning in cached["warnings"]])
+    else:
+        config = LabConfig.parse(conf)
+        common.write_cache(cache, {"key": key, "machines": config.machines, "options": config.options, "warnings": config.warnings})
+
+    for number, message in config.warnings:
+        common.logger.warning(f"{conf}:{number}: {message}")
+
+    lab_configs[str(conf)] = (key, config)
+
+    return config
+
+
+def lab_vhost_list(directory):
+    config = lab_config(directory)
+    if config is not None and config.machines is not None:
+        return config.machines
 
     # TODO: Space in name checking?
     lab_vhost_list_ = []
     for candidate in directory.iterdir():
-        if candidate.is_dir() and candidate.name not in ("shared", "_test", "CVS"):
+        if candidate.is_dir() and candidate.name not in ("shared", "_test", "CVS", "lab.snapshots"):
             lab_vhost_list_.append(candidate.name)
 
     return lab_vhost_list_
@@ -37,3 +181,197 @@ def vhost_list(arguments):
                 common.logger.warning(f"Machine {vhost} is not part of the lab in {arguments.directory}.")
 
         return vhost_list_
+
+
+# Builds the dependency graph of the given hosts and their dependencies from lab.dep.
+def lab_dependency_graph(directory, vhost_list):
+    dependency_graph = {}
+    for vhost in vhost_list:
+        dependency_graph[vhost] = []
+
+    # Ensure all specified hosts and their dependencies are in the dependency graph.
+    dep = directory / "lab.dep"
+    if dep.is_file():
+        dep_dependency_graph = {}
+        with dep.open() as f:
+            for line in f.readlines():
+                line = line.split("#")[0].strip()
+                if ":" in line:
+                    line = line.split(":")
+                    if len(line) >= 2:
+                        dep_dependency_graph[line[0].strip()] = line[1].strip().split()
+
+        for dependant in dependency_graph:
+            if dependant in dep_dependency_graph:
+                dependency_graph[dependant] = dep_dependency_graph[dependant]
+
+        pending = list(dependency_graph)
+        while len(pending) != 0:
+            for dependency in dependency_graph[pending.pop()]:
+                if dependency not in dependency_graph:
+                    dependency_graph[dependency] = dep_dependency_graph.get(dependency, [])
+                    pending.append(dependency)
+
+    return dependency_graph
+
+
+# Watches a lab directory for <vhost>.ready files, with inotify if it is available.
+class ReadyWatcher:
+    POLL_INTERVAL = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.expected = set()
+        self.appeared = set()
+        self.inotify = None
+
+        if inotify.available():
+            try:
+                self.inotify = inotify.Inotify()
+                self.inotify.add_watch(directory, inotify.IN_CREATE | inotify.IN_MOVED_TO)
+            except OSError as e:
+                common.logger.info(f"Falling back to polling for ready files: {e}")
+                self.close()
+
+    def ready_file(self, vhost):
+        return self.directory / f"{vhost}.ready"
+
+    # The file descriptor to wait on, or None if the watcher is polling.
+    def fileno(self):
+        return None if self.inotify is None else self.inotify.fileno()
+
+    # How long a caller may block before calling poll again, or None if it can block until fileno is readable.
+    def timeout(self):
+        if self.inotify is None and len(self.expected) != 0:
+            return self.POLL_INTERVAL
+
+        return None
+
+    def expect(self, vhost):
+        self.expected.add(vhost)
+
+        # The file may have appeared before the watcher was created.
+        if self.inotify is not None and self.ready_file(vhost).is_file():
+            self.appeared.add(vhost)
+
+    # Returns the expected hosts whose ready file has appeared. They are no longer expected afterwards.
+    def poll(self):
+        if self.inotify is None:
+            candidates = tuple(self.expected)
+        else:
+            candidates = self.appeared
+            self.appeared = set()
+            for _, mask, name in self.inotify.read():
+                if mask & inotify.IN_Q_OVERFLOW:
+                    candidates.update(self.expected)
+                elif name.endswith(".ready") and name[:-6] in self.expected:
+                    candidates.add(name[:-6])
+
+        ready = [vhost for vhost in candidates if self.ready_file(vhost).is_file()]
+        self.expected.difference_update(ready)
+
+        return ready
+
+    # Blocks until the ready file of a single host appears.
+    def wait(self, vhost, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        self.expect(vhost)
+
+        while vhost not in self.poll():
+            remaining = self.timeout()
+            if deadline is not None:
+                remaining = max(0, deadline - monotonic()) if remaining is None else min(remaining, max(0, deadline - monotonic()))
+                if remaining == 0:
+                    self.expected.discard(vhost)
+                    return False
+
+            select(() if self.inotify is None else (self.inotify,), (), (), remaining)
+
+        return True
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
+# Records how long each phase of a lab start takes, and the pid of each host's kernel.
+class Timings:
+    def __init__(self):
+        self.time = time()
+        self.lab = {}
+        self.vhosts = {}
+        self.marks = {}
+        self.pids = {}
+        self.counters = {}
+
+    def lab_phase(self, phase, seconds):
+        self.lab[phase] = round(seconds, 6)
+
+    def count(self, counter, value):
+        self.counters[counter] = value
+
+    def pid(self, vhost, pid):
+        self.pids[vhost] = pid
+
+    def mark(self, vhost):
+        self.marks[vhost] = monotonic()
+
+    def phase(self, vhost, phase):
+        now = monotonic()
+        self.vhosts.setdefault(vhost, {})[phase] = round(now - self.marks[vhost], 6)
+        self.marks[vhost] = now
+
+    # Appends the timings to the lab's history, one JSON object per line.
+    # Appends this run to lab.timings, dropping the oldest runs once there are more than TIMINGS_HISTORY.
+    def save(self, directory):
+        file = directory / "lab.timings"
+        line = dumps({"time": self.time, "lab": self.lab, "vhosts": self.vhosts, "pids": self.pids, "counters": self.counters}, separators=(",", ":")) + "\n"
+        try:
+            try:
+                with file.open() as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                lines = []
+
+            if len(lines) < TIMINGS_HISTORY:
+                with file.open("a") as f:
+                    f.write(line)
+            else:
+                temporary = file.with_name(f"{file.name}.{getpid()}.tmp")
+                with temporary.open("w") as f:
+                    f.writelines(lines[len(lines) - TIMINGS_HISTORY + 1:] + [line])
+                replace(temporary, file)
+        except OSError as e:
+            common.logger.warning(f"Unable to save the timings: {e}")
+
+
+def load_timings(directory):
+    records = []
+    try:
+        with (directory / "lab.timings").open() as f:
+            for line in f:
+                try:
+                    records.append(loads(line))
+                except ValueError:
+                    pass
+    except OSError:
+        pass
+
+    return records
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# The median time each host has taken to launch and boot in previous runs.
+def boot_times(records):
+    times = {}
+    for record in records:
+        for vhost, phases in record["vhosts"].items():
+            if "launch" in phases and "boot" in phases:
+                times.setdefault(vhost, []).append(phases["launch"] + phases["boot"])
+
+    return {vhost: percentile(times_, 0.5) for vhost, times_ in times.items()}
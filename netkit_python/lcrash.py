@@ -0,0 +1,27 @@
+from argparse import ArgumentParser
+from os import getcwd
+
+from . import common, lshutdown
+
+
+def main(arguments=None):
+    parser = ArgumentParser(prog="lcrash", description="The command used to crash a Netkit lab.")
+
+    parser.add_argument("-d", default=common.resolved_directory(getcwd()), type=common.resolved_directory, metavar="DIRECTORY", dest="directory")
+    parser.add_argument("-p", default=0, type=common.unsigned_integer, metavar="VALUE", dest="parallel")
+    parser.add_argument("-t", "--timeout", default=5, type=common.unsigned_integer, metavar="SECONDS", dest="timeout")
+    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose")
+    parser.add_argument(nargs="*", metavar="MACHINE-NAME", dest="vhost_list")
+
+    arguments = parser.parse_args(args=arguments)
+
+    common.verbose(arguments.verbose)
+
+    common.logger.info(f"lcrash arguments: {arguments}")
+
+    # The halt command stops the kernel immediately. All machines are crashed at once.
+    lshutdown.shutdown(arguments, "halt", ordered=False)
+
+
+if __name__ == "__main__":
+    main()
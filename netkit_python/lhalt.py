@@ -0,0 +1,27 @@
+from argparse import ArgumentParser
+from os import getcwd
+
+from . import common, lshutdown
+
+
+def main(arguments=None):
+    parser = ArgumentParser(prog="lhalt", description="The command used to gracefully halt a Netkit lab.")
+
+    parser.add_argument("-d", default=common.resolved_directory(getcwd()), type=common.resolved_directory, metavar="DIRECTORY", dest="directory")
+    parser.add_argument("-p", default=0, type=common.unsigned_integer, metavar="VALUE", dest="parallel")
+    parser.add_argument("-t", "--timeout", default=lshutdown.HALT_TIMEOUT, type=common.unsigned_integer, metavar="SECONDS", dest="timeout")
+    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose")
+    parser.add_argument(nargs="*", metavar="MACHINE-NAME", dest="vhost_list")
+
+    arguments = parser.parse_args(args=arguments)
+
+    common.verbose(arguments.verbose)
+
+    common.logger.info(f"lhalt arguments: {arguments}")
+
+    # Ctrl-Alt-Del makes the machine's init shut it down cleanly. Dependants are halted before their dependencies.
+    lshutdown.shutdown(arguments, "cad", ordered=True)
+
+
+if __name__ == "__main__":
+    main()
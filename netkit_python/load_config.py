@@ -0,0 +1,192 @@
+from os import environ, stat
+from pathlib import Path
+from re import compile
+
+from . import common
+
+# Ensure the script is not being run independently.
+if __name__ == "__main__":
+    raise common.NetkitError("This script is not intended for standalone use.")
+
+# The defaults from load_config.sh, in the order they are assigned.
+DEFAULTS = (
+    ("LOGFILENAME", ""),
+    ("MCONSOLE_DIR", "$HOME/.netkit/mconsole"),
+    ("HUB_SOCKET_DIR", "$HOME/.netkit/hubs"),
+    ("HUB_SOCKET_PREFIX", "vhub"),
+    ("HUB_SOCKET_EXTENSION", ".cnct"),
+    ("HUB_LOG", "$HUB_SOCKET_DIR/vhubs.log"),
+    ("VM_MEMORY", "32"),
+    ("VM_MEMORY_SKEW", "4"),
+    ("VM_MODEL_FS", "$NETKIT_HOME/fs/netkit-fs"),
+    ("VM_KERNEL", "$NETKIT_HOME/kernel/netkit-kernel"),
+    ("VM_CON0", "xterm"),
+    ("VM_CON1", "none"),
+    ("CON0_PORTHELPER", "no"),
+    ("TERM_TYPE", "xterm"),
+    ("MAX_INTERFACES", "40"),
+    ("MIN_MEM", "12"),
+    ("MAX_MEM", "512"),
+    ("MAX_SIMULTANEOUS_VMS", "5"),
+    ("MEMORY_HEADROOM", "256"),
+    ("GRACE_TIME", "0"),
+    ("PREWARM_BUDGET", "256"),
+    ("USE_SUDO", "yes"),
+    ("TMUX_OPEN_TERMS", "no"),
+    ("CHECK_FOR_UPDATES", "yes"),
+    ("UPDATE_CHECK_PERIOD", "5"),
+)
+
+# Environment variables that override the configuration files.
+OVERRIDES = (
+    ("NETKIT_FILESYSTEM", "VM_MODEL_FS"),
+    ("NETKIT_MEMORY", "VM_MEMORY"),
+    ("NETKIT_KERNEL", "VM_KERNEL"),
+    ("NETKIT_CON0", "VM_CON0"),
+    ("NETKIT_CON1", "VM_CON1"),
+    ("NETKIT_TERM", "TERM_TYPE"),
+)
+
+ASSIGNMENT = compile(r"(?:export\s+)?([A-Za-z_][A-Za-z0-9_]*)=(.*)")
+VARIABLE = compile(r"\$(?:([A-Za-z_][A-Za-z0-9_]*)|\{([A-Za-z_][A-Za-z0-9_]*)\})")
+UNQUOTED = compile(r"[^\s'\"\\`$;&|<>(){}*?\[\]~#]+")
+SINGLE_QUOTED = compile(r"'([^']*)'")
+DOUBLE_QUOTED = compile(r"\"((?:[^\"\\`$]|\$[A-Za-z_{])*)\"")
+
+
+# Raised when a configuration file contains something only the shell can evaluate.
+class ComplexConfig(Exception):
+    pass
+
+
+def files(netkit_home):
+    return Path("/etc/netkit.conf"), netkit_home / "netkit.conf", Path(environ["HOME"]) / ".netkit" / "netkit.conf"
+
+
+# Evaluates the value of a simple assignment. Escapes are left to the shell.
+def evaluate(value, variables, referenced):
+    def expand(string):
+        def substitute(match):
+            name = match.group(1) or match.group(2)
+            if name not in variables:
+                referenced[name] = environ.get(name)
+            return variables.get(name, environ.get(name, ""))
+
+        expanded = VARIABLE.sub(substitute, string)
+        if "$" in VARIABLE.sub("", string):
+            raise ComplexConfig()
+        return expanded
+
+    result = ""
+    position = 0
+    while position < len(value):
+        if value[position].isspace():
+            if value[position:].strip().startswith("#") or value[position:].strip() == "":
+                break
+            raise ComplexConfig()  # Multiple words, e.g. a command prefixed with assignments.
+
+        match = SINGLE_QUOTED.match(value, position)
+        if match is not None:
+            result += match.group(1)
+        else:
+            match = DOUBLE_QUOTED.match(value, position)
+            if match is not None:
+                result += expand(match.group(1))
+            else:
+                match = UNQUOTED.match(value, position) or VARIABLE.match(value, position)
+                if match is None:
+                    raise ComplexConfig()
+                result += expand(match.group(0))
+
+        position = match.end()
+
+    return result
+
+
+# Parses the configuration files natively. Only comments, blank lines and simple assignments are supported.
+def parse(netkit_home):
+    variables = {"NETKIT_HOME": str(netkit_home)}
+    referenced = {}
+
+    for file in files(netkit_home):
+        if not file.is_file():
+            continue
+
+        for line in file.read_text().splitlines():
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+
+            match = ASSIGNMENT.fullmatch(line)
+            if match is None:
+                raise ComplexConfig()
+
+            variables[match.group(1)] = evaluate(match.group(2), variables, referenced)
+
+    # Unset configuration keys take their value from the environment, as they would in the shell.
+    for key, _ in DEFAULTS:
+        if key not in variables and key in environ:
+            variables[key] = environ[key]
+
+    for key, default in DEFAULTS:
+        if variables.get(key, "") == "":
+            variables[key] = evaluate(f"\"{default}\"", variables, referenced)
+
+    for environment_variable, key in OVERRIDES:
+        if environ.get(environment_variable, "") != "":
+            variables[key] = environ[environment_variable]
+
+    return {key: variables[key] for key, _ in DEFAULTS}, referenced
+
+
+# Loads the configuration using load_config.sh, which supports everything the shell does.
+def parse_shell(netkit_home):
+    from base64 import b64decode
+    from subprocess import check_output
+
+    config = {}
+    for line in check_output(("/bin/sh", common.netkit_python_home / "load_config.sh", netkit_home)).decode().split("\n"):
+        line = line.strip().split()
+
+        if len(line) >= 2:
+            config[line[0]] = b64decode(line[1]).decode()[:-1]  # Strip out the "\n" appended by echo.
+
+    return config
+
+
+# The inputs that determine the configuration: the configuration files and the environment variables they can see.
+def key(netkit_home):
+    file_stats = {}
+    for file in files(netkit_home):
+        try:
+            file_stat = stat(file)
+            file_stats[str(file)] = [file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino]
+        except OSError:
+            file_stats[str(file)] = None
+
+    environment = {name: environ.get(name) for name in ("HOME",) + tuple(name for name, _ in DEFAULTS + OVERRIDES)}
+
+    return {"netkit_home": str(netkit_home), "files": file_stats, "environment": environment}
+
+
+# Loads the configuration, reusing a cached result if none of its inputs have changed.
+def load(netkit_home):
+    cache = common.cache_file("config.json")
+    key_ = key(netkit_home)
+
+    cached = common.read_cache(cache)
+    try:
+        if cached["key"] == key_ and all(environ.get(name) == value for name, value in cached["referenced"].items()):
+            return cached["config"]
+    except (KeyError, TypeError, AttributeError):
+        pass
+
+    try:
+        config, referenced = parse(netkit_home)
+    except ComplexConfig:
+        common.logger.info("The configuration is too complex to parse natively. Using load_config.sh.")
+        return parse_shell(netkit_home)  # Not cached, since the shell can read any environment variable.
+
+    common.write_cache(cache, {"key": key_, "referenced": referenced, "config": config})
+
+    return config
@@ -24,7 +24,9 @@ NETKIT_HOME="$1"
 : ${MIN_MEM:=12}
 : ${MAX_MEM:=512}
 : ${MAX_SIMULTANEOUS_VMS:=5}
+: ${MEMORY_HEADROOM:=256}
 : ${GRACE_TIME:=0}
+: ${PREWARM_BUDGET:=256}
 : ${USE_SUDO:="yes"}
 : ${TMUX_OPEN_TERMS:="no"}
 : ${CHECK_FOR_UPDATES:="yes"}
@@ -75,8 +77,12 @@ echo -n "MAX_MEM "
 echo "$MAX_MEM" | base64
 echo -n "MAX_SIMULTANEOUS_VMS "
 echo "$MAX_SIMULTANEOUS_VMS" | base64
+echo -n "MEMORY_HEADROOM "
+echo "$MEMORY_HEADROOM" | base64
 echo -n "GRACE_TIME "
 echo "$GRACE_TIME" | base64
+echo -n "PREWARM_BUDGET "
+echo "$PREWARM_BUDGET" | base64
 echo -n "USE_SUDO "
 echo "$USE_SUDO" | base64
 echo -n "TMUX_OPEN_TERMS "
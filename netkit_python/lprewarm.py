@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor
+from errno import ENXIO
+import os
+from struct import Struct
+
+from . import common
+
+# Ensure the script is not being run independently.
+if __name__ == "__main__":
+    raise common.NetkitError("This script is not intended for standalone use.")
+
+# The UML copy-on-write file format, version 3. The header is big-endian and packed.
+COW_MAGIC = 0x4f4f4f4d
+COW_VERSION = 3
+COW_SECTOR_SIZE = 512
+COW_ALIGNMENT = 4096
+COW_BITMAP = 0
+COW_PATH_LENGTH = 4096
+
+COW_HEADER = Struct(f">IIIQIII{COW_PATH_LENGTH}s")  # magic, version, mtime, size, sectorsize, alignment, cow_format, backing_file
+
+
+def round_up(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+# Creates an empty COW file for a backing file, atomically.
+def create_cow(cow, backing):
+    backing_stat = os.stat(backing)
+    backing_name = str(backing).encode()
+    if len(backing_name) >= COW_PATH_LENGTH:
+        raise common.NetkitError(f"The path of {backing} is too long for a COW file.")
+
+    bitmap_offset = round_up(COW_HEADER.size, COW_ALIGNMENT)
+    bitmap_length = (backing_stat.st_size + COW_SECTOR_SIZE - 1) // COW_SECTOR_SIZE
+    data_offset = round_up(bitmap_offset + (bitmap_length + 7) // 8, COW_ALIGNMENT)
+
+    header = COW_HEADER.pack(COW_MAGIC, COW_VERSION, int(backing_stat.st_mtime) & 0xffffffff, backing_stat.st_size, COW_SECTOR_SIZE, COW_ALIGNMENT, COW_BITMAP, backing_name)
+
+    temporary = cow.with_name(f".{cow.name}.{os.getpid()}")
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, header)
+        os.pwrite(fd, b"\0", data_offset + backing_stat.st_size - 1)  # Like the kernel, which leaves the rest sparse.
+    except BaseException:
+        os.close(fd)
+        temporary.unlink(missing_ok=True)
+        raise
+
+    os.close(fd)
+    os.replace(temporary, cow)
+
+
+# The (offset, length) of the regions of a file that hold data, skipping holes where possible.
+def data_regions(fd, size):
+    if not hasattr(os, "SEEK_DATA"):
+        yield 0, size
+        return
+
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+            end = os.lseek(fd, start, os.SEEK_HOLE)
+        except OSError as e:
+            if e.errno == ENXIO:  # There is no more data.
+                return
+            yield offset, size - offset  # SEEK_DATA is not supported.
+            return
+
+        yield start, end - start
+        offset = end
+
+
+# Asks the kernel to read up to budget bytes of the start of a file into the page cache. Returns the bytes requested.
+def prefetch(file, budget):
+    if budget == 0 or not hasattr(os, "posix_fadvise"):
+        return 0
+
+    prefetched = 0
+    fd = os.open(file, os.O_RDONLY)
+    try:
+        for offset, length in data_regions(fd, os.fstat(fd).st_size):
+            length = min(length, budget - prefetched)
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+            prefetched += length
+
+            if prefetched == budget:
+                break
+    finally:
+        os.close(fd)
+
+    return prefetched
+
+
+# Prefetches the model file systems and creates missing COW files, except hidden ones. Returns the bytes and COW files.
+def prewarm(specs, budget):
+    model_file_systems = tuple(dict.fromkeys(spec.model_file_system for spec, _ in specs.values() if spec.model_file_system.is_file()))
+    cows = [(spec.file_system, spec.model_file_system) for spec, vstart_arguments in specs.values() if not vstart_arguments.use_model_file_system and not spec.remove_file_system and spec.model_file_system.is_file() and not spec.file_system.exists()]
+
+    with ThreadPoolExecutor(max_workers=min(32, len(cows) + 1)) as executor:
+        created = [executor.submit(create_cow, cow, backing) for cow, backing in cows]
+
+        prefetched = 0
+        for model_file_system in model_file_systems:
+            try:
+                prefetched += prefetch(model_file_system, budget - prefetched)
+            except OSError as e:
+                common.logger.warning(f"Unable to prefetch {model_file_system}: {e}")
+
+        for (cow, _), future in zip(cows, created):
+            try:
+                future.result()
+            except OSError as e:
+                common.logger.warning(f"Unable to create {cow}, leaving it to the kernel: {e}")
+
+    return prefetched, sum(future.exception() is None for future in created)
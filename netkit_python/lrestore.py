@@ -0,0 +1,32 @@
+from argparse import ArgumentParser
+from os import getcwd
+from time import monotonic
+
+from . import common, lcommon, lsnapshot
+
+
+def main(arguments=None):
+    parser = ArgumentParser(prog="lrestore", description="Restores the disks of the machines of a halted Netkit lab from a snapshot.")
+
+    parser.add_argument("-d", default=common.resolved_directory(getcwd()), type=common.resolved_directory, metavar="DIRECTORY", dest="directory")
+    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose")
+    parser.add_argument(type=lsnapshot.snapshot_name, metavar="SNAPSHOT", dest="name")
+    parser.add_argument(nargs="*", metavar="MACHINE-NAME", dest="vhost_list")
+
+    arguments = parser.parse_args(args=arguments)
+
+    common.verbose(arguments.verbose)
+
+    common.logger.info(f"lrestore arguments: {arguments}")
+
+    vhosts = lcommon.vhost_list(arguments)
+    if len(vhosts) == 0:
+        raise common.NetkitError("No machines to restore.")
+
+    start_time = monotonic()
+    disks, cloned = lsnapshot.restore(arguments.directory, arguments.name, vhosts)
+    lsnapshot.report("Restored", arguments.name, disks, cloned, monotonic() - start_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+from heapq import heappop, heappush
+from os import sched_getaffinity
+from time import monotonic
+
+from . import common
+
+# Ensure the script is not being run independently.
+if __name__ == "__main__":
+    raise common.NetkitError("This script is not intended for standalone use.")
+
+
+# Ensures the dependency graph is acyclic using a single iterative DFS. If a cycle is found it is reported.
+def check_acyclic(dependency_graph):
+    finished = set()
+    for start_node in dependency_graph:
+        if start_node in finished:
+            continue
+
+        # The current path, as a stack of (node, iterator over its dependencies).
+        path = [(start_node, iter(dependency_graph[start_node]))]
+        on_path = {start_node: 0}
+
+        while len(path) != 0:
+            node, dependencies = path[-1]
+
+            for dependency in dependencies:
+                if dependency in on_path:
+                    cycle = [vhost for vhost, _ in path[on_path[dependency]:]] + [dependency]
+                    raise common.NetkitError(f"The dependency graph is not acyclic: {' -> '.join(cycle)}.")
+
+                if dependency not in finished:
+                    on_path[dependency] = len(path)
+                    path.append((dependency, iter(dependency_graph.get(dependency, ()))))
+                    break
+            else:
+                path.pop()
+                del on_path[node]
+                finished.add(node)
+
+
+# The weight of each host: its expected boot time if known, otherwise the mean of the known boot times, or 1.
+def weights(dependency_graph, boot_times=None):
+    boot_times = {} if boot_times is None else boot_times
+    known = [boot_times[vhost] for vhost in dependency_graph if vhost in boot_times]
+    default = sum(known) / len(known) if len(known) != 0 else 1
+
+    return {vhost: boot_times.get(vhost, default) for vhost in dependency_graph}
+
+
+# The priority of each host: the weighted length of the longest chain of dependants starting at it.
+def priorities(dependency_graph, weights_):
+    dependants = {vhost: [] for vhost in dependency_graph}
+    for dependant, dependencies in dependency_graph.items():
+        for dependency in dict.fromkeys(dependencies):
+            dependants[dependency].append(dependant)
+
+    # Visit the hosts in reverse topological order, so each host is visited after all of its dependants.
+    priorities_ = {}
+    for vhost in reversed(topological_order(dependency_graph)):
+        priorities_[vhost] = weights_[vhost] + max((priorities_[dependant] for dependant in dependants[vhost]), default=0)
+
+    return priorities_
+
+
+def topological_order(dependency_graph):
+    scheduler = Scheduler(dependency_graph)
+    order = []
+    while len(scheduler.ready) != 0:
+        vhost = scheduler.next()
+        scheduler.finish(vhost)
+        order.append(vhost)
+
+    return order
+
+
+# Schedules hosts after their dependencies using Kahn's algorithm, highest priority first.
+class Scheduler:
+    def __init__(self, dependency_graph, priorities_=None):
+        self.dependants = {vhost: [] for vhost in dependency_graph}
+        self.pending = {}
+        self.priorities = {} if priorities_ is None else priorities_
+        self.order = {vhost: index for index, vhost in enumerate(dependency_graph)}
+        self.ready = []  # A heap of (-priority, order, vhost).
+        self.running = set()
+        self.remaining = len(dependency_graph)
+
+        for dependant, dependencies in dependency_graph.items():
+            dependencies = tuple(dict.fromkeys(dependencies))  # Remove duplicates but keep the order.
+            self.pending[dependant] = len(dependencies)
+
+            for dependency in dependencies:
+                self.dependants[dependency].append(dependant)
+
+        for vhost, pending in self.pending.items():
+            if pending == 0:
+                self.push(vhost)
+
+    def push(self, vhost):
+        heappush(self.ready, (-self.priorities.get(vhost, 0), self.order[vhost], vhost))
+
+    # Takes the next ready host, or the first one admit accepts. Returns None if there is none.
+    def next(self, admit=None):
+        rejected = []
+        vhost = None
+        while len(self.ready) != 0:
+            candidate = heappop(self.ready)
+            if admit is None or admit(candidate[2]):
+                vhost = candidate[2]
+                break
+            rejected.append(candidate)
+
+        for candidate in rejected:
+            heappush(self.ready, candidate)
+
+        if vhost is not None:
+            self.running.add(vhost)
+
+        return vhost
+
+    # Marks a host as finished, moving any dependants without other unfinished dependencies to the ready queue.
+    def finish(self, vhost):
+        self.running.remove(vhost)
+        self.remaining -= 1
+
+        for dependant in self.dependants[vhost]:
+            if self.pending[dependant] is None:  # Dropped.
+                continue
+
+            self.pending[dependant] -= 1
+            if self.pending[dependant] == 0:
+                self.push(dependant)
+
+    # Marks a host as failed. Its dependants are dropped and returned.
+    def fail(self, vhost):
+        self.running.remove(vhost)
+        self.remaining -= 1
+
+        dropped = []
+        pending = list(self.dependants[vhost])
+        while len(pending) != 0:
+            dependant = pending.pop()
+            if self.pending[dependant] is not None:
+                self.pending[dependant] = None
+                self.remaining -= 1
+                dropped.append(dependant)
+                pending.extend(self.dependants[dependant])
+
+        return dropped
+
+    def done(self):
+        return self.remaining == 0
+
+
+# Predicts the schedule of a lab as a list of (start, finish, vhost), taking weights as boot times.
+def plan(dependency_graph, weights_, priorities_, slots):
+    scheduler = Scheduler(dependency_graph, priorities_)
+    running = []  # A heap of (finish, vhost).
+    schedule = []
+    now = 0
+
+    while not scheduler.done():
+        while len(scheduler.ready) != 0 and (slots == 0 or len(running) < slots):
+            vhost = scheduler.next()
+            heappush(running, (now + weights_[vhost], vhost))
+            schedule.append((now, now + weights_[vhost], vhost))
+
+        now, vhost = heappop(running)
+        scheduler.finish(vhost)
+
+    return schedule
+
+
+# The chain of hosts with the longest weighted length, from its first host to its last.
+def critical_path(dependency_graph, priorities_):
+    dependants = {vhost: [] for vhost in dependency_graph}
+    for dependant, dependencies in dependency_graph.items():
+        for dependency in dependencies:
+            dependants[dependency].append(dependant)
+
+    roots = [vhost for vhost, dependencies in dependency_graph.items() if len(dependencies) == 0]
+    if len(roots) == 0:
+        return []
+
+    path = [max(roots, key=lambda vhost: priorities_[vhost])]
+    while len(dependants[path[-1]]) != 0:
+        path.append(max(dependants[path[-1]], key=lambda vhost: priorities_[vhost]))
+
+    return path
+
+
+# The memory the host can still give to new processes without swapping, in MiB, or None if it is unknown.
+def memory_available():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+
+# Admits hosts while their memory fits in the memory available, less a headroom.
+class MemoryAdmission:
+    POLL_INTERVAL = 1
+
+    def __init__(self, memory, headroom):
+        self.memory = memory  # vhost -> MiB
+        self.headroom = headroom
+        self.reserved = {}
+        self.available = None
+        self.blocked = False
+
+    # Samples the available memory. This should be called before a round of admissions.
+    def sample(self):
+        self.available = memory_available()
+
+    # How long a caller may wait before sampling again, or None if only a host finishing can admit another.
+    def timeout(self):
+        return self.POLL_INTERVAL if self.blocked else None
+
+    def admit(self, vhost):
+        required = self.memory[vhost] + sum(self.reserved.values()) + self.headroom
+
+        # Always admit a host if nothing else is starting, otherwise the lab could never start.
+        if self.available is not None and len(self.reserved) != 0 and required > self.available:
+            if not self.blocked:
+                common.logger.info(f"Waiting for memory to start {vhost}: {required} MiB required, {self.available} MiB available.")
+                self.blocked = True
+            return False
+
+        self.reserved[vhost] = self.memory[vhost]
+        self.blocked = False
+        return True
+
+    def release(self, vhost):
+        self.reserved.pop(vhost, None)
+
+
+# The total stall time in microseconds of each resource from PSI, or None if it is unavailable.
+def pressure_totals():
+    totals = {}
+    try:
+        for resource in ("cpu", "io", "memory"):
+            with open(f"/proc/pressure/{resource}") as f:
+                some = f.readline().split()
+                totals[resource] = int(some[-1].split("=")[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return totals
+
+
+# The number of runnable tasks other than this one, from /proc/loadavg.
+def runnable():
+    try:
+        with open("/proc/loadavg") as f:
+            return max(0, int(f.read().split()[3].split("/")[0]) - 1)
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+# Adapts the number of hosts started at once to the pressure on the host (AIMD).
+class PressureController:
+    INTERVAL = 0.5
+    HOLD = 2
+    PSI_THRESHOLD = 0.25
+    LOAD_THRESHOLD = 1.0
+
+    def __init__(self):
+        self.cpus = len(sched_getaffinity(0))
+        self.maximum = 4 * self.cpus
+        self.limit = max(1, self.cpus // 2)
+        self.totals = pressure_totals()
+        self.time = monotonic()
+        self.hold = 0
+
+        common.logger.info(f"Adaptive concurrency using {'PSI' if self.totals is not None else 'the load'}, starting at {self.limit}.")
+
+    # Returns the resource under the most pressure, its pressure and the threshold above which it is too high.
+    def pressure(self, elapsed):
+        if self.totals is not None:
+            totals = pressure_totals()
+            if totals is not None:
+                pressures = {resource: (totals[resource] - self.totals[resource]) / 1e6 / elapsed for resource in totals}
+                self.totals = totals
+                resource = max(pressures, key=pressures.get)
+                return resource, pressures[resource], self.PSI_THRESHOLD
+
+            self.totals = None
+
+        return "load", runnable() / self.cpus, self.LOAD_THRESHOLD
+
+    # How long a caller may wait before the next sample is due.
+    def timeout(self):
+        return max(0, self.time + self.INTERVAL - monotonic())
+
+    # Samples the pressure if an interval has passed and adjusts the limit. running is the number of hosts starting.
+    def sample(self, running):
+        now = monotonic()
+        if now - self.time < self.INTERVAL:
+            return
+
+        resource, pressure, threshold = self.pressure(now - self.time)
+        self.time = now
+
+        limit = self.limit
+        if self.hold != 0:
+            self.hold -= 1
+        elif pressure > threshold:
+            limit = max(1, self.limit // 2)
+            self.hold = self.HOLD
+        elif running >= self.limit:
+            limit = min(self.maximum, self.limit + 1)
+
+        if limit != self.limit:
+            common.logger.info(f"Concurrency {self.limit} -> {limit} ({resource} pressure {pressure:.2f}, threshold {threshold:.2f}).")
+            self.limit = limit
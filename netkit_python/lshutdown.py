@@ -0,0 +1,186 @@
+from heapq import heappop, heappush
+import os
+from pathlib import Path
+from select import select
+from signal import SIGKILL, SIGTERM
+from time import monotonic
+
+from . import common, lcommon, lschedule, mconsole
+
+# Ensure the script is not being run independently.
+if __name__ == "__main__":
+    raise common.NetkitError("This script is not intended for standalone use.")
+
+HALT_TIMEOUT = 120  # Seconds a halted machine is given to shut down before it is killed.
+
+
+# Waits for processes that are not our children to exit, with pidfds where possible.
+class ExitWatcher:
+    POLL_INTERVAL = 0.1
+
+    def __init__(self):
+        self.pidfds = {}  # pidfd -> pid
+        self.polled = set()
+        self.exited = []
+
+    def watch(self, pid):
+        if hasattr(os, "pidfd_open"):
+            try:
+                self.pidfds[os.pidfd_open(pid)] = pid
+                return
+            except ProcessLookupError:
+                self.exited.append(pid)
+                return
+            except OSError:
+                pass
+
+        self.polled.add(pid)
+
+    def watched(self):
+        return len(self.pidfds) + len(self.polled) + len(self.exited)
+
+    # Waits up to timeout seconds, or forever if it is None, and returns the pids that have exited.
+    def wait(self, timeout=None):
+        if len(self.exited) != 0:
+            timeout = 0
+        elif len(self.polled) != 0:
+            timeout = self.POLL_INTERVAL if timeout is None else min(timeout, self.POLL_INTERVAL)
+
+        exited, self.exited = self.exited, []
+        for pidfd in select(tuple(self.pidfds), (), (), timeout)[0]:
+            exited.append(self.pidfds.pop(pidfd))
+            os.close(pidfd)
+
+        for pid in tuple(self.polled):
+            if not alive(pid):
+                self.polled.remove(pid)
+                exited.append(pid)
+
+        return exited
+
+    def close(self):
+        for pidfd in self.pidfds:
+            os.close(pidfd)
+        self.pidfds.clear()
+
+
+# Determines if a process is running. A process that has exited but has not been reaped yet (a zombie) is not.
+def alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return False
+
+
+def kill(pids, signal):
+    for pid in pids:
+        try:
+            os.kill(pid, signal)
+        except ProcessLookupError:
+            pass
+
+
+# Stops those of the given hubs that no running machine is connected to. Returns the hubs whose servers were all stopped.
+def stop_unused_hubs(hubs, snapshot, exited=()):
+    snapshot.refresh(exited)
+    uid = os.geteuid()
+
+    def used(hub):
+        return any(len(snapshot.processes[pid][1]) != 0 for pid in snapshot.hubs.get(hub, ()))
+
+    stopped = set()
+    for hub in (hub for hub in hubs if not used(hub)):
+        servers = snapshot.hubs.get(hub, ())
+        killed = 0
+        for pid in servers:
+            _, umids, _, pid_hubs = snapshot.processes[pid]
+            if len(umids) == 0 and snapshot.processes[pid][0] == uid and not any(used(pid_hub) for pid_hub in pid_hubs):
+                common.logger.info(f"Stopping hub process {pid} serving {', '.join(pid_hubs)}.")
+                kill((pid,), SIGTERM)
+                killed += 1
+
+        # A hub still served by a process left running keeps its socket.
+        if killed == len(servers):
+            stopped.add(hub)
+            if Path(hub).is_socket():
+                Path(hub).unlink(missing_ok=True)
+
+    return stopped
+
+
+# Shuts down the machines of a lab by sending command to their management consoles, killing them after timeout seconds.
+def shutdown(arguments, command, ordered):
+    vhost_list = lcommon.vhost_list(arguments)
+    if len(vhost_list) == 0:
+        raise common.NetkitError("No machines to shut down.")
+
+    # Reverse the dependency graph, keeping only the machines being shut down.
+    dependants = {vhost: [] for vhost in vhost_list}
+    if ordered:
+        for dependant, dependencies in lcommon.lab_dependency_graph(arguments.directory, vhost_list).items():
+            for dependency in dependencies:
+                if dependency in dependants and dependant in dependants:
+                    dependants[dependency].append(dependant)
+
+    lschedule.check_acyclic(dependants)
+
+    snapshot = common.ProcSnapshot(fds=False)
+    uid = os.geteuid()
+    scheduler = lschedule.Scheduler(dependants)
+    client = mconsole.Mconsole()
+    watcher = ExitWatcher()
+    running = {}  # vhost -> pids that have not exited.
+    owners = {}  # pid -> vhost
+    deadlines = []  # A heap of (deadline, vhost).
+    hubs = set()
+    exited = set()
+    try:
+        while not scheduler.done():
+            started = []
+            while len(scheduler.ready) != 0 and (arguments.parallel == 0 or len(scheduler.running) < arguments.parallel):
+                vhost = scheduler.next()
+                pids = snapshot.pids(vhost, uid)
+                if len(pids) == 0:
+                    print(f"{vhost} is not running.")
+                    scheduler.finish(vhost)
+                    continue
+
+                running[vhost] = set(pids)
+                for pid in pids:
+                    owners[pid] = vhost
+                    hubs.update(snapshot.processes[pid][3])
+                    watcher.watch(pid)
+
+                started.append(vhost)
+
+            if len(started) != 0:
+                print(f"Shutting down: {' '.join(started)}")
+
+                # The machines reply as soon as the command is accepted. Machines that don't are left to their deadline.
+                for vhost, (ok, output) in zip(started, client.batch([(vhost, command) for vhost in started], min(arguments.timeout, 5))):
+                    if not ok:
+                        common.logger.warning(f"{vhost}: {output}")
+
+                    heappush(deadlines, (monotonic() + arguments.timeout, vhost))
+
+            timeout = max(0, deadlines[0][0] - monotonic()) if len(deadlines) != 0 else None
+            for pid in watcher.wait(timeout) if watcher.watched() != 0 else ():
+                exited.add(pid)
+                vhost = owners.pop(pid)
+                running[vhost].discard(pid)
+                if len(running[vhost]) == 0:
+                    del running[vhost]
+                    scheduler.finish(vhost)
+
+            while len(deadlines) != 0 and deadlines[0][0] <= monotonic():
+                vhost = heappop(deadlines)[1]
+                if vhost in running:
+                    common.logger.warning(f"{vhost} did not shut down within {arguments.timeout} seconds. Killing it.")
+                    kill(running[vhost], SIGKILL)
+    finally:
+        watcher.close()
+        client.close()
+
+    for hub in sorted(stop_unused_hubs(hubs, snapshot, exited)):
+        common.logger.info(f"Stopped hub {hub}.")
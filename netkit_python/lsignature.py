@@ -0,0 +1,100 @@
+from hashlib import sha1
+from json import dumps
+from os import readlink, scandir, stat
+from stat import S_ISDIR, S_ISLNK, S_ISREG
+
+from . import common, lcommon
+
+# Ensure the script is not being run independently.
+if __name__ == "__main__":
+    raise common.NetkitError("This script is not intended for standalone use.")
+
+CHUNK_SIZE = 1 << 20
+
+
+# The signatures of the machines of a lab, stored in lab.signature.
+class Signatures:
+    def __init__(self, directory, rebuild=False):
+        self.directory = directory
+        self.file = directory / "lab.signature"
+
+        data = None if rebuild else common.read_cache(self.file)
+        if not isinstance(data, dict):
+            data = {}
+
+        self.vhosts = data.get("vhosts", {})  # vhost -> signature
+        self.hashes = data.get("files", {})  # path relative to the lab -> [mtime_ns, ctime_ns, size, ino, digest]
+        self.seen = set()
+
+    def file_digest(self, relative_path, file_stat):
+        key = [file_stat.st_mtime_ns, file_stat.st_ctime_ns, file_stat.st_size, file_stat.st_ino]
+        self.seen.add(relative_path)
+
+        cached = self.hashes.get(relative_path)
+        if cached is not None and cached[:4] == key:
+            return cached[4]
+
+        digest = sha1()
+        with (self.directory / relative_path).open("rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+
+        self.hashes[relative_path] = key + [digest.hexdigest()]
+
+        return digest.hexdigest()
+
+    # Adds a file or directory tree to a hash: the path, type and mode of each entry and the contents of each file.
+    def update(self, digest, relative_path):
+        try:
+            path_stat = stat(self.directory / relative_path, follow_symlinks=False)
+        except OSError:
+            digest.update(f"{relative_path}:missing\0".encode())
+            return
+
+        digest.update(f"{relative_path}:{path_stat.st_mode:o}\0".encode())
+
+        if S_ISREG(path_stat.st_mode):
+            digest.update(self.file_digest(relative_path, path_stat).encode())
+        elif S_ISLNK(path_stat.st_mode):
+            digest.update(readlink(self.directory / relative_path).encode(errors="surrogateescape"))
+        elif S_ISDIR(path_stat.st_mode):
+            with scandir(self.directory / relative_path) as entries:
+                names = sorted(entry.name for entry in entries)
+
+            for name in names:
+                self.update(digest, f"{relative_path}/{name}")
+
+    def signature(self, vhost, spec):
+        digest = sha1()
+
+        config = lcommon.lab_config(self.directory)
+        digest.update(dumps(config.options.get(vhost, []) if config is not None else []).encode())
+
+        # The kernel and model file system are too large to hash, so their identity is used instead.
+        for file in (spec.kernel, spec.model_file_system):
+            try:
+                file_stat = stat(file)
+                digest.update(f"{file}:{file_stat.st_size}:{file_stat.st_mtime_ns}:{file_stat.st_ino}\0".encode())
+            except OSError:
+                digest.update(f"{file}:missing\0".encode())
+
+        for relative_path in (f"{vhost}.startup", vhost, "shared.startup", "shared"):
+            self.update(digest, relative_path)
+
+        return digest.hexdigest()
+
+    def signatures(self, specs):
+        return {vhost: self.signature(vhost, spec) for vhost, (spec, _) in specs.items()}
+
+    # Records the signatures of machines that have been started.
+    def save(self, signatures):
+        self.vhosts.update(signatures)
+
+        def owner(relative_path):
+            top = relative_path.split("/", 1)[0]
+            return top[:-len(".startup")] if top.endswith(".startup") else top
+
+        owners = set(signatures) | {"shared"}
+        files = {path: value for path, value in self.hashes.items() if path in self.seen or owner(path) not in owners}
+
+        common.write_cache(self.file, {"vhosts": self.vhosts, "files": files})
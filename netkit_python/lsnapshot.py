@@ -0,0 +1,193 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from errno import EBADF, EINVAL, ENOTTY, EOPNOTSUPP, EXDEV
+from fcntl import ioctl
+import os
+from shutil import rmtree
+from time import monotonic
+
+from . import common, lcommon, lprewarm
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int)
+COPY_CHUNK_SIZE = 1 << 24
+
+
+# The snapshots of a lab are directories of COW disks in lab.snapshots, named after the snapshot.
+def snapshot_directory(directory, name=None):
+    return directory / "lab.snapshots" if name is None else directory / "lab.snapshots" / name
+
+
+def snapshot_name(string):
+    if string in ("", ".", "..") or "/" in string or string.startswith("."):
+        raise common.NetkitError(f"{string!r} is not a valid snapshot name.")
+
+    return string
+
+
+# Copies the data regions of a file, leaving its holes as holes.
+def sparse_copy(source, destination, size):
+    for offset, length in lprewarm.data_regions(source, size):
+        while length != 0:
+            try:
+                copied = os.copy_file_range(source, destination, min(length, COPY_CHUNK_SIZE), offset, offset)
+            except (AttributeError, OSError):  # Before Python 3.8 or Linux 5.3 across file systems.
+                data = os.pread(source, min(length, COPY_CHUNK_SIZE), offset)
+                copied = os.pwrite(destination, data, offset)
+
+            if copied == 0:  # The file has shrunk.
+                break
+
+            offset += copied
+            length -= copied
+
+    os.ftruncate(destination, size)
+
+
+# Copies a disk, as a reflink if possible. Returns whether the disk was cloned.
+def clone(source, destination):
+    temporary = destination.with_name(f".{destination.name}.{os.getpid()}")
+    source_fd = os.open(source, os.O_RDONLY)
+    try:
+        destination_fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, os.fstat(source_fd).st_mode & 0o777)
+        try:
+            try:
+                ioctl(destination_fd, FICLONE, source_fd)
+                cloned = True
+            except OSError as e:
+                if e.errno not in (EBADF, EINVAL, ENOTTY, EOPNOTSUPP, EXDEV):
+                    raise
+
+                sparse_copy(source_fd, destination_fd, os.fstat(source_fd).st_size)
+                cloned = False
+        finally:
+            os.close(destination_fd)
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+    finally:
+        os.close(source_fd)
+
+    os.replace(temporary, destination)
+
+    return cloned
+
+
+# Clones each (source, destination) in parallel. Returns the number of disks that were cloned rather than copied.
+def clone_all(pairs):
+    with ThreadPoolExecutor(max_workers=min(32, len(pairs) + 1)) as executor:
+        return sum(executor.map(lambda pair: clone(*pair), pairs))
+
+
+# Disks must not be copied while their machine is running, as they would be inconsistent.
+def check_halted(vhosts):
+    snapshot = common.ProcSnapshot(fds=False)
+    running = [vhost for vhost in vhosts if snapshot.pid(vhost, os.geteuid()) is not None]
+    if len(running) != 0:
+        raise common.NetkitError(f"These machines are running: {' '.join(running)}. Halt them first.")
+
+
+# Captures the COW disks of the given machines as a snapshot. Returns the number of disks and how many were cloned.
+def snapshot(directory, name, vhosts):
+    check_halted(vhosts)
+
+    destination = snapshot_directory(directory, name)
+    temporary = snapshot_directory(directory, f".{name}.{os.getpid()}")
+    temporary.mkdir(parents=True)
+    try:
+        pairs = [(directory / f"{vhost}.disk", temporary / f"{vhost}.disk") for vhost in vhosts if (directory / f"{vhost}.disk").is_file()]
+        cloned = clone_all(pairs)
+
+        # A previous snapshot with the same name keeps the disks of the machines that were not captured this time.
+        if destination.is_dir():
+            for entry in destination.iterdir():
+                if entry.name.endswith(".disk") and entry.name[:-len(".disk")] not in vhosts:
+                    os.replace(entry, temporary / entry.name)
+
+            rmtree(destination)
+
+        os.replace(temporary, destination)
+    except BaseException:
+        rmtree(temporary, ignore_errors=True)
+        raise
+
+    return len(pairs), cloned
+
+
+# Restores the COW disks of the given machines from a snapshot. Returns the number of disks and how many were cloned.
+def restore(directory, name, vhosts):
+    source = snapshot_directory(directory, name)
+    if not source.is_dir():
+        raise common.NetkitError(f"There is no snapshot named {name}.")
+
+    check_halted(vhosts)
+
+    pairs = []
+    for vhost in vhosts:
+        if (source / f"{vhost}.disk").is_file():
+            pairs.append((source / f"{vhost}.disk", directory / f"{vhost}.disk"))
+        else:
+            (directory / f"{vhost}.disk").unlink(missing_ok=True)
+
+    return len(pairs), clone_all(pairs)
+
+
+def report(action, name, disks, cloned, seconds):
+    print(f"{action} snapshot {name}: {disks} disks ({cloned} cloned, {disks - cloned} copied) in {seconds:.3f} seconds.")
+
+
+def list_snapshots(directory):
+    snapshots = sorted(entry for entry in snapshot_directory(directory).glob("[!.]*") if entry.is_dir()) if snapshot_directory(directory).is_dir() else []
+    if len(snapshots) == 0:
+        print("This lab has no snapshots.")
+        return
+
+    print(f"{'SNAPSHOT':<24} {'DISKS':>5} {'ALLOCATED':>10}  CREATED")
+    for entry in snapshots:
+        disks = list(entry.glob("*.disk"))
+        allocated = sum(disk.stat().st_blocks * 512 for disk in disks)
+        created = datetime.fromtimestamp(entry.stat().st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{entry.name:<24} {len(disks):>5} {allocated / (1 << 20):>9.1f}M  {created}")
+
+
+def main(arguments=None):
+    parser = ArgumentParser(prog="lsnapshot", description="Captures the disks of the machines of a halted Netkit lab as a named snapshot.")
+
+    parser.add_argument("-d", default=common.resolved_directory(os.getcwd()), type=common.resolved_directory, metavar="DIRECTORY", dest="directory")
+    parser.add_argument("-l", "--list", action="store_true", dest="list_snapshots")
+    parser.add_argument("--delete", action="store_true", dest="delete")
+    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose")
+    parser.add_argument(nargs="?", type=snapshot_name, metavar="SNAPSHOT", dest="name")
+    parser.add_argument(nargs="*", metavar="MACHINE-NAME", dest="vhost_list")
+
+    arguments = parser.parse_args(args=arguments)
+
+    common.verbose(arguments.verbose)
+
+    common.logger.info(f"lsnapshot arguments: {arguments}")
+
+    if arguments.list_snapshots:
+        list_snapshots(arguments.directory)
+        return
+
+    if arguments.name is None:
+        raise common.NetkitError("No snapshot name was given.")
+
+    if arguments.delete:
+        if not snapshot_directory(arguments.directory, arguments.name).is_dir():
+            raise common.NetkitError(f"There is no snapshot named {arguments.name}.")
+
+        rmtree(snapshot_directory(arguments.directory, arguments.name))
+        return
+
+    vhosts = lcommon.vhost_list(arguments)
+    if len(vhosts) == 0:
+        raise common.NetkitError("No machines to snapshot.")
+
+    start_time = monotonic()
+    disks, cloned = snapshot(arguments.directory, arguments.name, vhosts)
+    report("Captured", arguments.name, disks, cloned, monotonic() - start_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,186 +1,288 @@
-from argparse import ArgumentParser
-from multiprocessing import Process
-from subprocess import call
+from argparse import ArgumentParser, Namespace
 from shlex import split
-from os import getcwd
-from time import sleep
-
-from . import common, lcommon, vstart
-
-
-def start(vhost, arguments):
-    vstart_arguments = arguments.passthrough
-
-    # Parse arguments from lab.conf.
-    conf = arguments.directory / "lab.conf"
-    if conf.is_file():
-        with conf.open() as f:
-            assigned = set()
-
-            for line in f.readlines():
-                line = line.strip()
-                if line.startswith(f"{vhost}["):
-                    line = line.split("=")
-                    key = line[0].split("[")[1].split("]")[0].strip()
-                    value = line[1].strip()
-
-                    if key in assigned:
-                        common.logger.warning(f"{vhost}[{key}] is assigned multiple times. Using the first assignment.")
-                    else:
-                        assigned.add(key)
-
-                        if " " in value:
-                            common.logger.warning(f"{vhost}[{key}]'s argument contains spaces. These will be removed.")
-                            value = value.replace(" ", "")
-
-                        if key.isdigit():
-                            if not value.startswith("tap"):
-                                if "," in value or "." in value:
-                                    common.logger.warning(f"{vhost}[{key}]'s argument contains commas or dots. These will be removed.")
-                                    value = value.replace(",", "").replace(".", "")
-
-                            if "_" in value:
-                                common.logger.warning(f"{vhost}[{key}]'s argument contains underscores. These will be removed.")
-                                value = value.replace("_", "")
-
-                            key = f"--eth{key}"
-                        elif key.startswith("append"):
-                            key = "--append"
-                        else:
-                            if len(key) == 1:
-                                key = f"-{key}"
-                            else:
-                                key = f"--{key}"
-
-                        vstart_arguments.append(key)
-
-                        if len(value) > 0:
-                            vstart_arguments.append(value)
-
-    vstart_arguments.append("--hostlab")
-    vstart_arguments.append(str(arguments.directory))
-    vstart_arguments.append("--hostwd")
-    vstart_arguments.append(str(common.resolved_directory(getcwd())))
-    vstart_arguments.append("--filesystem")
-    vstart_arguments.append(str(arguments.directory / f"{vhost}.disk"))
-    vstart_arguments.append(vhost)
-
-    if not arguments.verbose:
-        vstart_arguments.append("-q")
+from os import getcwd, geteuid, sched_setaffinity
+from time import monotonic, sleep
+
+from . import common, lcommon, lprewarm, lschedule, lshutdown, lsignature, lsnapshot, placement, vcommon, vstart
+
+
+# Generates the vstart arguments and launch spec of a host.
+def prepare(vhost, arguments):
+    vstart_arguments = vstart.default_arguments(vhost)
+    vstart.apply_options(vstart_arguments, arguments.passthrough)
+
+    # Apply the arguments from lab.conf.
+    config = lcommon.lab_config(arguments.directory)
+    if config is not None:
+        for option, value in config.vstart_options(vhost):
+            vstart.apply_option(vstart_arguments, option, value)
+
+    vstart_arguments.host_lab = arguments.directory
+    vstart_arguments.host_working_directory = common.resolved_directory(getcwd())
+    vstart_arguments.file_system = vstart.file_system(arguments.directory / f"{vhost}.disk")
+    vstart_arguments.quiet = vstart_arguments.quiet or not arguments.verbose
 
     # TODO: Testing mode.
 
-    ready = arguments.directory / f"{vhost}.ready"
+    common.logger.info(f"Generated vstart arguments: {vstart_arguments}")
+
+    return vstart.spec(vstart_arguments), vstart_arguments
+
+
+def prepare_all(vhosts, arguments):
+    return {vhost: prepare(vhost, arguments) for vhost in vhosts}
+
+
+# Starts every hub used by the lab concurrently, once each.
+def start_hubs(specs, arguments, hub_cpus=None):
+    hubs = tuple(dict.fromkeys(hub for spec, _ in specs.values() for hub in spec.hubs))
+
+    common.logger.info(f"Starting hubs: {hubs}")
+
+    if arguments.switch_daemon:
+        vcommon.run_switch_daemon(hubs, Namespace(quiet=not arguments.verbose, print=False), hub_cpus)
+    else:
+        vcommon.run_hubs(hubs, Namespace(quiet=not arguments.verbose, print=False), hub_cpus)
+
+
+# Launches a host without waiting for it to boot. The lab's hubs must already be running. Returns the kernel's process.
+def launch(spec, vstart_arguments, arguments, snapshot=None):
+    ready = arguments.directory / f"{spec.vhost}.ready"
     ready.unlink(missing_ok=True)
 
-    common.logger.info(f"Generated vstart arguments: {vstart_arguments}")
+    print(f"Starting: {spec.vhost}")
 
-    print(f"Starting: {vhost}")
+    return vstart.launch(spec, vstart_arguments, hubs=False, snapshot=snapshot, detach_helpers=arguments.fast_mode)  # Without -f, lstart waits for the boot anyway.
 
-    # vstart.main(vstart_arguments)
 
-    vstart_arguments.insert(0, "vstart")
-    call(vstart_arguments)
+def start(vhost, specs, arguments, watcher, timings):
+    timings.mark(vhost)
+    process = launch(*specs[vhost], arguments)
+    timings.phase(vhost, "launch")
+    if process is not None:
+        timings.pid(vhost, process.pid)
 
     if not arguments.fast_mode:
-        while not ready.is_file():
-            sleep(1)
-
-        ready.unlink(missing_ok=True)
+        watcher.wait(vhost)
+        watcher.ready_file(vhost).unlink(missing_ok=True)
+        timings.phase(vhost, "boot")
 
     sleep(arguments.grace_time)
+    timings.phase(vhost, "grace")
+
+
+# Places the hosts on CPUs following --placement and --reserve-cpus. Returns the CPUs of each hub, or None.
+def place(specs, arguments):
+    if arguments.placement == "none" and arguments.reserve_cpus == 0:
+        return None
+
+    hubs = {vhost: [hub for hub in spec.hubs if not isinstance(hub, tuple)] for vhost, (spec, _) in specs.items()}
+    reserved, vhost_cpus = placement.place(arguments.placement, hubs, arguments.reserve_cpus)
+    for vhost, (spec, _) in specs.items():
+        if spec.cpus is None:
+            spec.cpus = vhost_cpus[vhost]
+
+    hub_cpus = placement.hub_cpus(hubs, {vhost: spec.cpus for vhost, (spec, _) in specs.items()})
+
+    if len(reserved) != 0:
+        sched_setaffinity(0, reserved)
+
+    record = common.read_cache(arguments.directory / "lab.placement")
+    record = record if isinstance(record, dict) else {}
+    record.update(policy=arguments.placement, reserved=placement.format_cpu_list(reserved))
+    record.setdefault("vhosts", {}).update({vhost: placement.format_cpu_list(spec.cpus) for vhost, (spec, _) in specs.items()})
+    record.setdefault("hubs", {}).update({str(hub): placement.format_cpu_list(cpus) for hub, cpus in hub_cpus.items()})
+    common.write_cache(arguments.directory / "lab.placement", record)
+
+    common.logger.info(f"Placement: {record}")
+
+    return hub_cpus
+
+
+# Starts the hubs of the lab, recording how long they took.
+def start_hubs_timed(specs, arguments, timings):
+    hub_cpus = place(specs, arguments)
+
+    start_time = monotonic()
+    start_hubs(specs, arguments, hub_cpus)
+    timings.lab_phase("hubs", monotonic() - start_time)
+
+
+# Restores the hosts' disks from the snapshot given with --snapshot, if any, recording how long it took.
+def restore_timed(specs, arguments, timings):
+    if arguments.snapshot is None:
+        return
+
+    start_time = monotonic()
+    disks, cloned = lsnapshot.restore(arguments.directory, arguments.snapshot, list(specs))
+    timings.lab_phase("restore", monotonic() - start_time)
+
+    lsnapshot.report("Restored", arguments.snapshot, disks, cloned, timings.lab["restore"])
+
+
+# Prefetches the model file systems and creates the hosts' COW files before any host is launched.
+def prewarm_timed(specs, arguments, timings):
+    budget = common.config["PREWARM_BUDGET"] if arguments.prewarm_budget is None else arguments.prewarm_budget
+
+    start_time = monotonic()
+    prefetched, created = lprewarm.prewarm(specs, budget << 20)
+    timings.lab_phase("prewarm", monotonic() - start_time)
+    timings.count("prewarm_bytes", prefetched)
 
+    print(f"Prefetched {prefetched / (1 << 20):.1f} MiB of the model file system and created {created} disks.")
 
-def start_sequential(arguments):
+
+def start_sequential(arguments, timings):
     vhost_list = lcommon.vhost_list(arguments)
     if len(vhost_list) == 0:
         raise common.NetkitError("No machines to start.")
 
-    for vhost in vhost_list:
-        start(vhost, arguments)
+    specs = prepare_all(vhost_list, arguments)
+    restore_timed(specs, arguments, timings)
+    start_hubs_timed(specs, arguments, timings)
+    prewarm_timed(specs, arguments, timings)
+
+    watcher = lcommon.ReadyWatcher(arguments.directory)
+    try:
+        for vhost in vhost_list:
+            start(vhost, specs, arguments, watcher, timings)
+    finally:
+        watcher.close()
+
+    return specs
+
+
+def print_plan(dependency_graph, weights, priorities, max_processes):
+    print(f"Predicted schedule ({'unlimited' if max_processes == 0 else max_processes} simultaneous machines):")
+    for start_time, finish_time, vhost in lschedule.plan(dependency_graph, weights, priorities, max_processes):
+        print(f"  {start_time:8.2f} - {finish_time:8.2f}  {vhost}")
+
+    critical_path = lschedule.critical_path(dependency_graph, priorities)
+    print(f"Critical path ({sum(weights[vhost] for vhost in critical_path):.2f}): {' -> '.join(critical_path)}")
+
+
+# Starts the hosts of the lab, or those in dependency_graph if it is given, in parallel. Returns the specs of the hosts.
+def start_parallel(arguments, timings, dependency_graph=None, specs=None):
+    if dependency_graph is None:
+        vhost_list = lcommon.vhost_list(arguments)
+        if len(vhost_list) == 0:
+            raise common.NetkitError("No machines to start.")
+
+        dependency_graph = lcommon.lab_dependency_graph(arguments.directory, vhost_list)
+
+    common.logger.info(f"Dependency graph: {dependency_graph}")
+
+    lschedule.check_acyclic(dependency_graph)
+
+    max_processes = common.config["MAX_SIMULTANEOUS_VMS"] if arguments.parallel is None else arguments.parallel
+    controller = None
+    if max_processes == "auto":
+        controller = lschedule.PressureController()
+        max_processes = controller.limit
+    weights = lschedule.weights(dependency_graph, lcommon.boot_times(lcommon.load_timings(arguments.directory)))
+    priorities = lschedule.priorities(dependency_graph, weights)
+
+    if arguments.plan:
+        print_plan(dependency_graph, weights, priorities, max_processes)
+        return None
+
+    if specs is None:
+        specs = prepare_all(dependency_graph, arguments)
+    restore_timed(specs, arguments, timings)
+    start_hubs_timed(specs, arguments, timings)
+    prewarm_timed(specs, arguments, timings)
+
+    # Start the hosts making sure that dependencies are started first.
+    headroom = common.config["MEMORY_HEADROOM"] if arguments.memory_headroom is None else arguments.memory_headroom
+    scheduler = lschedule.Scheduler(dependency_graph, priorities)
+    admission = lschedule.MemoryAdmission({vhost: spec.memory + common.config["VM_MEMORY_SKEW"] for vhost, (spec, _) in specs.items()}, headroom)
+    # asyncio takes longer to import than the rest of lstart, so it is only imported when it is needed.
+    from asyncio import run
+    from . import lsupervisor
+
+    supervisor = lsupervisor.Supervisor(arguments, timings, scheduler, admission, specs, max_processes, launch, controller)
+    try:
+        run(supervisor.run())
+    except KeyboardInterrupt:
+        raise common.NetkitError("The lab start was interrupted. Machines that were already launched are still running.")
+
+    return specs
 
 
-def start_parallel(arguments):
+# Restarts the hosts whose signature has changed, and their dependants, and starts those that are not running.
+def start_incremental(arguments, timings, signatures):
     vhost_list = lcommon.vhost_list(arguments)
     if len(vhost_list) == 0:
         raise common.NetkitError("No machines to start.")
 
-    dependency_graph = {}
-    for vhost in vhost_list:
-        dependency_graph[vhost] = []
-
-    # Ensure all specified hosts and their dependencies are in the dependency graph.
-    dep = arguments.directory / "lab.dep"
-    if dep.is_file():
-        dep_dependency_graph = {}
-        with dep.open() as f:
-            for line in f.readlines():
-                line = line.split("#")[0].strip()
-                if ":" in line:
-                    line = line.split(":")
-                    if len(line) >= 2:
-                        dep_dependency_graph[line[0].strip()] = line[1].strip().split()
-
-        for dependant in dependency_graph:
-            if dependant in dep_dependency_graph:
-                dependency_graph[dependant] = dep_dependency_graph[dependant]
-
-        made_change = True
-        while made_change:
-            made_change = False
-            for dependencies in tuple(dependency_graph.values()):
-                for dependency in dependencies:
-                    if dependency not in dependency_graph:
-                        dependency_graph[dependency] = dep_dependency_graph.get(dependency, [])
-                        made_change = True
+    dependency_graph = lcommon.lab_dependency_graph(arguments.directory, vhost_list)
+    lschedule.check_acyclic(dependency_graph)
 
-    common.logger.info(f"Dependency graph: {dependency_graph}")
+    specs = prepare_all(dependency_graph, arguments)
+    current = signatures.signatures(specs)
 
-    # A BFS to ensure the dependency graph is acyclic. Not very efficient.
-    for start_node in dependency_graph:
-        queue = [start_node]
-        visited = []
+    snapshot = common.ProcSnapshot(fds=False)
+    running = {vhost for vhost in dependency_graph if snapshot.pid(vhost, geteuid()) is not None}
+    changed = [vhost for vhost in dependency_graph if vhost in running and current[vhost] != signatures.vhosts.get(vhost)]
 
-        while len(queue) != 0:
-            current = queue.pop(0)
+    dependants = {vhost: [] for vhost in dependency_graph}
+    for dependant, dependencies in dependency_graph.items():
+        for dependency in dependencies:
+            dependants[dependency].append(dependant)
 
-            if current in visited:
-                raise common.NetkitError("The dependency graph is not acyclic.")
+    restart = set(changed)
+    pending = list(changed)
+    while len(pending) != 0:
+        for dependant in dependants[pending.pop()]:
+            if dependant not in restart:
+                restart.add(dependant)
+                pending.append(dependant)
 
-            visited.append(current)
+    restart &= running
+    start_set = restart | (set(dependency_graph) - running)
+    if len(start_set) == 0:
+        print("Nothing has changed.")
+        return {}
 
-            for node in dependency_graph[current]:
-                queue.append(node)
+    if len(restart) != 0:
+        print(f"Restarting: {' '.join(vhost for vhost in dependency_graph if vhost in restart)}")
+        lshutdown.shutdown(Namespace(directory=arguments.directory, vhost_list=[vhost for vhost in dependency_graph if vhost in restart], parallel=0, timeout=arguments.halt_timeout), "cad", ordered=True)
 
-    # Start the hosts making sure that dependencies are started first.
-    max_processes = common.config["MAX_SIMULTANEOUS_VMS"] if arguments.parallel is None else arguments.parallel
-    processes = {}
-    while len(dependency_graph) != 0 or len(processes) != 0:
-        for dependant, dependencies in dependency_graph.items():
-            if dependant in processes:  # We are already processing this dependant.
-                continue
-
-            can_process = True
-            for dependency in dependencies:
-                if dependency in dependency_graph:
-                    can_process = False
-                    break
-
-            if can_process:
-                process = Process(target=start, args=(dependant, arguments))
-                processes[dependant] = process
-                process.start()
-
-            if max_processes != 0 and len(processes) >= max_processes:
-                break
-
-        len_processes = len(processes)
-        while len(processes) == len_processes:
-            sleep(1)
-            for dependant in tuple(processes):
-                if not processes[dependant].is_alive():
-                    del dependency_graph[dependant]
-                    del processes[dependant]
+    # Dependencies that are not being started are already running.
+    dependency_graph = {vhost: [dependency for dependency in dependencies if dependency in start_set] for vhost, dependencies in dependency_graph.items() if vhost in start_set}
+
+    return start_parallel(arguments, timings, dependency_graph, {vhost: specs[vhost] for vhost in dependency_graph})
+
+
+# Prints percentiles of the time taken by each phase, for the lab and for each host, across all recorded runs.
+def print_timings(arguments):
+    records = lcommon.load_timings(arguments.directory)
+    if len(records) == 0:
+        raise common.NetkitError("No timings have been recorded for this lab.")
+
+    phases = {}
+    for record in records:
+        for phase, seconds in record["lab"].items():
+            phases.setdefault(("(lab)", phase), []).append(seconds)
+
+        for vhost, vhost_phases in record["vhosts"].items():
+            for phase, seconds in vhost_phases.items():
+                phases.setdefault((vhost, phase), []).append(seconds)
+
+    print(f"Timings over {len(records)} runs, in seconds:")
+    print(f"  {'MACHINE':<16} {'PHASE':<10} {'RUNS':>5} {'P50':>9} {'P90':>9} {'MAX':>9}")
+    for (vhost, phase), seconds in phases.items():
+        print(f"  {vhost:<16} {phase:<10} {len(seconds):>5} {lcommon.percentile(seconds, 0.5):>9.3f} {lcommon.percentile(seconds, 0.9):>9.3f} {max(seconds):>9.3f}")
+
+    # Compare the boot times of the runs that prefetched the model file system with those of the runs that didn't.
+    boots = {True: [], False: []}
+    for record in records:
+        prewarmed = record.get("counters", {}).get("prewarm_bytes", 0) != 0
+        boots[prewarmed].extend(vhost_phases["boot"] for vhost_phases in record["vhosts"].values() if "boot" in vhost_phases)
+
+    if len(boots[True]) != 0 and len(boots[False]) != 0:
+        with_prewarm, without_prewarm = lcommon.percentile(boots[True], 0.5), lcommon.percentile(boots[False], 0.5)
+        print(f"Median boot time: {with_prewarm:.3f} prefetched, {without_prewarm:.3f} not prefetched, {without_prewarm - with_prewarm:.3f} saved.")
 
 
 def main(arguments=None):
@@ -198,10 +300,20 @@ def main(arguments=None):
     parser.add_argument("-o", "--pass", default=[], type=split, metavar="OPTIONS", dest="passthrough")  # TODO: How do we handle passthrough?
 
     startup_mode_group = parser.add_mutually_exclusive_group()
-    startup_mode_group.add_argument("-p", type=common.unsigned_integer, metavar="VALUE", dest="parallel")
+    startup_mode_group.add_argument("-p", type=common.concurrency, metavar="VALUE", dest="parallel")
     startup_mode_group.add_argument("-s", "--sequential", action="store_true", dest="sequential")
 
+    parser.add_argument("--memory-headroom", type=common.unsigned_integer, metavar="MIB", dest="memory_headroom")
+    parser.add_argument("--placement", default="none", choices=placement.POLICIES, metavar="POLICY", dest="placement")
+    parser.add_argument("--reserve-cpus", default=0, type=common.unsigned_integer, metavar="COUNT", dest="reserve_cpus")
+    parser.add_argument("--prewarm-budget", type=common.unsigned_integer, metavar="MIB", dest="prewarm_budget")
+    parser.add_argument("--incremental", action="store_true", dest="incremental")
+    parser.add_argument("--halt-timeout", default=lshutdown.HALT_TIMEOUT, type=common.unsigned_integer, metavar="SECONDS", dest="halt_timeout")
+    parser.add_argument("--snapshot", type=lsnapshot.snapshot_name, metavar="SNAPSHOT", dest="snapshot")
+    parser.add_argument("--plan", action="store_true", dest="plan")
+    parser.add_argument("--timings", action="store_true", dest="timings")
     parser.add_argument("-v", "--verbose", action="store_true", dest="verbose")
+    parser.add_argument("--switch-daemon", action="store_true", dest="switch_daemon")
     parser.add_argument("--version", action="store_true", dest="show_version")
     parser.add_argument("-w", "--wait", default=0, type=common.unsigned_integer, metavar="SECONDS", dest="grace_time")
     parser.add_argument("-S", "--script-mode", action="store_true", dest="script_mode")
@@ -223,13 +335,35 @@ def main(arguments=None):
     if not conf_present and not dep_present and not arguments.force:
         raise common.NetkitError("This does not appear to be a lab directory. Use option -F to convince me it is.")
 
+    if arguments.timings:
+        print_timings(arguments)
+        return
+
     # TODO: Update stuff.
     # TODO: Lab info printing.
 
-    if (dep_present and not arguments.sequential) or arguments.parallel is not None:
-        start_parallel(arguments)
+    timings = lcommon.Timings()
+    timings.lab_phase("config", common.config_load_time)
+
+    start_time = monotonic()
+    lcommon.lab_config(arguments.directory)
+    timings.lab_phase("lab_conf", monotonic() - start_time)
+
+    signatures = lsignature.Signatures(arguments.directory, rebuild=arguments.create_signature)
+
+    if arguments.incremental and not arguments.plan:
+        specs = start_incremental(arguments, timings, signatures)
+    elif (dep_present and not arguments.sequential) or arguments.parallel is not None or arguments.plan:
+        specs = start_parallel(arguments, timings)
     else:
-        start_sequential(arguments)
+        specs = start_sequential(arguments, timings)
+
+    if not arguments.plan:
+        timings.lab_phase("total", monotonic() - start_time)
+        timings.save(arguments.directory)
+
+        # Record what the started hosts were started from, for --incremental.
+        signatures.save(signatures.signatures(specs))
 
 
 if __name__ == "__main__":
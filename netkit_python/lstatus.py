@@ -0,0 +1,190 @@
+from argparse import ArgumentParser
+from json import dumps
+from os import geteuid, getcwd, sched_getaffinity, stat, sysconf
+from time import monotonic, sleep, time
+
+from . import common, lcommon, placement
+
+CLOCK_TICKS = sysconf("SC_CLK_TCK")
+PAGE_SIZE = sysconf("SC_PAGE_SIZE")
+
+
+# The time of the boot. /proc/uptime is used rather than btime in /proc/stat, which is rounded to the second.
+def boot_time():
+    with open("/proc/uptime") as f:
+        return time() - float(f.read().split()[0])
+
+
+# Reads the CPU time, start time (since boot) and RSS of a process, or returns None if it has exited.
+def process_stat(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+
+    if fields[0] == "Z":
+        return None
+
+    # The fields after the command name, starting from the state (field 3 in proc(5)).
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, int(fields[19]) / CLOCK_TICKS, int(fields[21]) * PAGE_SIZE
+
+
+# The CPUs a process may run on, as a CPU list, or None if it has exited.
+def process_cpus(pid):
+    try:
+        return placement.format_cpu_list(sched_getaffinity(pid))
+    except OSError:
+        return None
+
+
+# The name of a collision domain from its hub socket.
+def domain(hub):
+    name = hub.rsplit("/", 1)[-1]
+    prefix = f"""{common.config["HUB_SOCKET_PREFIX"]}_{common.user_id}_"""
+    extension = common.config["HUB_SOCKET_EXTENSION"]
+
+    if name.startswith(prefix) and name.endswith(extension):
+        return name[len(prefix):len(name) - len(extension)]
+
+    return name
+
+
+# Collects the status of the hosts of a lab. /proc is only rescanned every RESCAN_INTERVAL seconds.
+class LabStatus:
+    RESCAN_INTERVAL = 5
+
+    def __init__(self, directory, vhosts):
+        self.directory = directory
+        self.vhosts = vhosts
+        self.snapshot = common.ProcSnapshot(fds=False)
+        self.scanned = monotonic()
+        self.timings_stat = None
+        self.booted = {}  # vhost -> the pid of the kernel seen booting by the last start that saw it boot.
+
+    # The hosts seen booting by lstart, from lab.timings. It is only reread when it changes.
+    def update_booted(self):
+        try:
+            timings_stat = stat(self.directory / "lab.timings")
+            timings_stat = (timings_stat.st_mtime_ns, timings_stat.st_size)
+        except OSError:
+            timings_stat = None
+
+        if timings_stat != self.timings_stat:
+            self.timings_stat = timings_stat
+            self.booted = {}
+            for record in lcommon.load_timings(self.directory):
+                for vhost, phases in record["vhosts"].items():
+                    if "boot" in phases and vhost in record.get("pids", {}):
+                        self.booted[vhost] = record["pids"][vhost]
+
+    def status(self, vhost, now):
+        pids = sorted(self.snapshot.pids(vhost, geteuid()))
+        stats = [process_stat(pid) for pid in pids]
+
+        # A process whose start time has changed since it was scanned has exited and its pid has been reused.
+        stats = [None if stat_ is None or stat_[1] != self.snapshot.start_times[pid] / CLOCK_TICKS else stat_ for pid, stat_ in zip(pids, stats)]
+        pids = [pid for pid, stat_ in zip(pids, stats) if stat_ is not None]
+        stats = [stat_ for stat_ in stats if stat_ is not None]
+
+        if len(pids) == 0:
+            return {"vhost": vhost, "running": False, "pid": None, "pids": [], "ready": False, "rss": None, "cpu": None, "uptime": None, "cpus": None, "hubs": []}
+
+        started = boot_time() + min(start for _, start, _ in stats)
+        ready = (self.directory / f"{vhost}.ready").is_file() or self.booted.get(vhost) in pids
+
+        return {
+            "vhost": vhost,
+            "running": True,
+            "pid": pids[0],
+            "pids": pids,
+            "ready": ready,
+            # The processes of a machine share its memory, so the largest RSS is used rather than the sum.
+            "rss": max(rss for _, _, rss in stats),
+            "cpu": round(sum(cpu for cpu, _, _ in stats), 2),
+            "uptime": round(now - started, 2),
+            "cpus": process_cpus(pids[0]),
+            "hubs": sorted({hub for pid in pids for hub in self.snapshot.processes[pid][3]}),
+        }
+
+    def collect(self, refresh=False):
+        if refresh and monotonic() - self.scanned >= self.RESCAN_INTERVAL:
+            self.snapshot.refresh()
+            self.scanned = monotonic()
+
+        self.update_booted()
+        now = time()
+
+        return [self.status(vhost, now) for vhost in self.vhosts]
+
+
+def print_header():
+    print(f"{'MACHINE':<16} {'PID':>8} {'STATE':<8} {'READY':<5} {'RSS':>9} {'CPU':>9} {'UPTIME':>9} {'CPUS':<9}  HUBS")
+
+
+def print_status(status):
+    if not status["running"]:
+        print(f"{status['vhost']:<16} {'-':>8} {'stopped':<8} {'-':<5} {'-':>9} {'-':>9} {'-':>9} {'-':<9}  -", flush=True)
+        return
+
+    rss = f"{status['rss'] / (1 << 20):.1f}M"
+    hubs = ",".join(domain(hub) for hub in status["hubs"]) or "-"
+    print(f"{status['vhost']:<16} {status['pid']:>8} {'running':<8} {'yes' if status['ready'] else 'no':<5} {rss:>9} {status['cpu']:>8.2f}s {status['uptime']:>8.0f}s {status['cpus'] or '-':<9}  {hubs}", flush=True)
+
+
+# The fields whose changes are reported by --watch. CPU time is rounded so idle machines stay quiet.
+def watched_fields(status):
+    return status["pids"], status["ready"], status["rss"], None if status["cpu"] is None else round(status["cpu"], 1), status["hubs"]
+
+
+def main(arguments=None):
+    parser = ArgumentParser(prog="lstatus", description="Shows the status of the machines of a Netkit lab.")
+
+    parser.add_argument("-d", default=common.resolved_directory(getcwd()), type=common.resolved_directory, metavar="DIRECTORY", dest="directory")
+    parser.add_argument("-j", "--json", action="store_true", dest="json")
+    parser.add_argument("-w", "--watch", nargs="?", const=1, type=float, metavar="SECONDS", dest="watch")
+    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose")
+    parser.add_argument(nargs="*", metavar="MACHINE-NAME", dest="vhost_list")
+
+    arguments = parser.parse_args(args=arguments)
+
+    common.verbose(arguments.verbose)
+
+    common.logger.info(f"lstatus arguments: {arguments}")
+
+    vhosts = lcommon.vhost_list(arguments)
+    if len(vhosts) == 0:
+        raise common.NetkitError("No machines to show.")
+
+    lab_status = LabStatus(arguments.directory, vhosts)
+    statuses = lab_status.collect()
+
+    if arguments.json:
+        print(dumps(statuses) if arguments.watch is None else "\n".join(dumps(status) for status in statuses), flush=True)
+    else:
+        print_header()
+        for status in statuses:
+            print_status(status)
+
+    if arguments.watch is None:
+        return
+
+    # Stream the hosts whose status has changed, one line (or JSON object) each.
+    previous = {status["vhost"]: watched_fields(status) for status in statuses}
+    try:
+        while True:
+            sleep(arguments.watch)
+
+            for status in lab_status.collect(refresh=True):
+                if watched_fields(status) != previous[status["vhost"]]:
+                    previous[status["vhost"]] = watched_fields(status)
+                    if arguments.json:
+                        print(dumps(status), flush=True)
+                    else:
+                        print_status(status)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
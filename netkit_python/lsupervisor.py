@@ -0,0 +1,228 @@
+from asyncio import FIRST_COMPLETED, TimeoutError, create_task, gather, get_running_loop, shield, sleep, wait, wait_for
+import os
+
+from . import common, lcommon, lshutdown
+
+# Ensure the script is not being run independently.
+if __name__ == "__main__":
+    raise common.NetkitError("This script is not intended for standalone use.")
+
+
+# Waits for a process to exit, with a pidfd watched by the event loop where possible.
+async def exited(pid):
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            return
+        except OSError:
+            pidfd = None
+
+        if pidfd is not None:
+            loop = get_running_loop()
+            future = loop.create_future()
+            loop.add_reader(pidfd, lambda: future.done() or future.set_result(None))
+            try:
+                await future
+            finally:
+                loop.remove_reader(pidfd)
+                os.close(pidfd)
+            return
+
+    while lshutdown.alive(pid):
+        await sleep(lshutdown.ExitWatcher.POLL_INTERVAL)
+
+
+# Adapts a ReadyWatcher to asyncio. Waiting for a host is a future.
+class AsyncReadyWatcher:
+    def __init__(self, directory):
+        self.watcher = lcommon.ReadyWatcher(directory)
+        self.loop = get_running_loop()
+        self.futures = {}  # vhost -> future
+        self.poller = None
+
+        if self.watcher.fileno() is not None:
+            self.loop.add_reader(self.watcher.fileno(), self.poll)
+
+    def ready_file(self, vhost):
+        return self.watcher.ready_file(vhost)
+
+    # Returns a future which completes once the host's ready file appears.
+    def ready(self, vhost):
+        future = self.loop.create_future()
+        self.futures[vhost] = future
+        self.watcher.expect(vhost)
+
+        if self.watcher.fileno() is None and self.poller is None:
+            self.poller = self.loop.create_task(self.poll_periodically())
+
+        self.poll()
+
+        return future
+
+    def poll(self):
+        for vhost in self.watcher.poll():
+            future = self.futures.pop(vhost, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def poll_periodically(self):
+        while True:
+            await sleep(self.watcher.POLL_INTERVAL)
+            self.poll()
+
+    def close(self):
+        if self.watcher.fileno() is not None:
+            self.loop.remove_reader(self.watcher.fileno())
+
+        if self.poller is not None:
+            self.poller.cancel()
+
+        for future in self.futures.values():
+            future.cancel()
+
+        self.watcher.close()
+
+
+# Starts the hosts of a lab as tasks of a single event loop. With futures, a failure only stops the host's dependants.
+class Supervisor:
+    def __init__(self, arguments, timings, scheduler, admission, specs, max_processes, launch, controller=None, futures=None, ready_timeout=None, booting=None, awaiting=None):
+        self.arguments = arguments
+        self.timings = timings
+        self.scheduler = scheduler
+        self.admission = admission
+        self.specs = specs
+        self.max_processes = max_processes
+        self.launch = launch
+        self.controller = controller
+        self.futures = futures
+        self.ready_timeout = ready_timeout
+        self.booting = {} if booting is None else booting  # vhost -> pid
+        self.awaiting = {} if awaiting is None else awaiting  # vhost -> the future of a start already under way
+        self.watcher = None
+
+    async def start(self, vhost, snapshot=None):
+        if vhost in self.awaiting:
+            await shield(self.awaiting[vhost])
+        else:
+            await self.bring_up(vhost, snapshot)
+
+        self.admission.release(vhost)
+        self.scheduler.finish(vhost)
+        self.settle(vhost)
+
+    # Launches a host, unless it is already booting, and waits for it to boot and for its grace time.
+    async def bring_up(self, vhost, snapshot):
+        self.timings.mark(vhost)
+        if vhost in self.booting:
+            pid = self.booting[vhost]
+        else:
+            process = self.launch(*self.specs[vhost], self.arguments, snapshot)  # This only spawns the kernel.
+            self.timings.phase(vhost, "launch")
+            pid = None if process is None else process.pid
+
+        if pid is not None:
+            self.timings.pid(vhost, pid)
+
+        if not self.arguments.fast_mode:
+            try:
+                await wait_for(self.boot(vhost, pid), self.ready_timeout)
+            except TimeoutError:
+                raise lcommon.ReadyTimeout(vhost, f"{vhost} did not become ready within {self.ready_timeout} seconds.")
+            self.watcher.ready_file(vhost).unlink(missing_ok=True)
+            self.timings.phase(vhost, "boot")
+
+        await sleep(self.arguments.grace_time)
+        self.timings.phase(vhost, "grace")
+
+    # Waits for the ready file of a host whose kernel's process is pid, failing if the host exits first.
+    async def boot(self, vhost, pid):
+        ready = self.watcher.ready(vhost)
+        try:
+            while pid is not None:
+                exit_ = create_task(exited(pid))
+                try:
+                    await wait((ready, exit_), return_when=FIRST_COMPLETED)
+                finally:
+                    exit_.cancel()
+
+                if ready.done() or self.watcher.ready_file(vhost).is_file():
+                    return
+
+                # The process may have been a wrapper that left the kernel running.
+                pid = common.pid(vhost, common.user_id)
+                if pid is None:
+                    raise lcommon.StartError(vhost, f"{vhost} exited before it was ready.")
+
+            await ready
+        finally:
+            ready.cancel()
+
+    # Resolves the future of a host, with an error if given.
+    def settle(self, vhost, error=None):
+        future = None if self.futures is None else self.futures.get(vhost)
+        if future is None or future.done():
+            return
+
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+    def fail(self, vhost, error):
+        if self.futures is None:
+            raise error
+
+        self.admission.release(vhost)
+
+        if not isinstance(error, lcommon.StartError):
+            cause, error = error, lcommon.StartError(vhost, f"{vhost} failed to start: {error}")
+            error.__cause__ = cause
+        self.settle(vhost, error)
+
+        for dependant in self.scheduler.fail(vhost):
+            self.settle(dependant, lcommon.DependencyError(dependant, f"{dependant} was not started because {vhost} failed to start.", vhost))
+
+    async def run(self):
+        self.watcher = AsyncReadyWatcher(self.arguments.directory)
+        tasks = {}  # task -> vhost
+        try:
+            while not self.scheduler.done():
+                self.admission.sample()
+                max_processes = self.max_processes
+                if self.controller is not None:
+                    self.controller.sample(len(self.scheduler.running))
+                    max_processes = self.controller.limit
+
+                snapshot = None  # /proc is refreshed once for the hosts started in this round.
+                while len(self.scheduler.ready) != 0 and (max_processes == 0 or len(self.scheduler.running) < max_processes):
+                    vhost = self.scheduler.next(self.admission.admit)
+                    if vhost is None:
+                        break
+
+                    if snapshot is None:
+                        snapshot = common.proc_snapshot()
+
+                    tasks[create_task(self.start(vhost, snapshot))] = vhost
+
+                # Wake up to sample the memory or the pressure again.
+                timeouts = [timeout for timeout in (self.admission.timeout(), None if self.controller is None else self.controller.timeout()) if timeout is not None]
+                timeout = min(timeouts) if len(timeouts) != 0 else None
+                if len(tasks) == 0:
+                    await sleep(timeout or 0)
+                    continue
+
+                finished, _ = await wait(tasks, timeout=timeout, return_when=FIRST_COMPLETED)
+                for task in finished:
+                    vhost = tasks.pop(task)
+                    if task.exception() is not None:
+                        self.fail(vhost, task.exception())
+        finally:
+            for task in tasks:
+                task.cancel()
+            await gather(*tasks, return_exceptions=True)
+
+            for future in () if self.futures is None else self.futures.values():
+                future.cancel()
+
+            self.watcher.close()
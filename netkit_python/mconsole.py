@@ -0,0 +1,146 @@
+from argparse import ArgumentParser
+from collections import deque
+from os.path import normpath
+from select import select
+from socket import AF_UNIX, SOCK_DGRAM, socket
+from struct import Struct
+from time import monotonic
+
+from . import common
+
+# The UML management console protocol, spoken over a datagram socket at <uml_dir>/<umid>/mconsole.
+MCONSOLE_MAGIC = 0xcafebabe
+MCONSOLE_VERSION = 2
+MCONSOLE_MAX_DATA = 512
+
+REQUEST = Struct(f"=III{MCONSOLE_MAX_DATA}s")  # struct mconsole_request { u32 magic; u32 version; u32 len; char data[]; }
+REPLY = Struct(f"=III{MCONSOLE_MAX_DATA}s")  # struct mconsole_reply { u32 err; u32 more; u32 len; char data[]; }
+
+
+def socket_path(vhost):
+    return common.config["MCONSOLE_DIR"] / vhost / "mconsole"
+
+
+def request(command):
+    data = command.encode()
+    if len(data) >= MCONSOLE_MAX_DATA:
+        raise common.NetkitError(f"The mconsole command {command!r} is too long.")
+
+    return REQUEST.pack(MCONSOLE_MAGIC, MCONSOLE_VERSION, len(data), data)
+
+
+# A client which can send commands to many machines at once over a single socket.
+class Mconsole:
+    def __init__(self):
+        self.socket = socket(AF_UNIX, SOCK_DGRAM)
+        self.socket.bind("")  # Linux binds an unused abstract address, which the replies are sent to.
+        self.socket.setblocking(False)
+
+    # Runs a list of (vhost, command) and returns a list of (ok, output), waiting for machines that are still booting.
+    def batch(self, commands, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        paths = [normpath(socket_path(vhost)) for vhost, _ in commands]
+        requests = [request(command) for _, command in commands]
+        results = [None] * len(commands)
+
+        unsent = deque(range(len(commands)))
+        outstanding = {}  # path -> deque of the indexes of the commands sent to it, in order.
+        output = {}  # index -> the output received so far.
+        delay = 0.01
+
+        while len(unsent) != 0 or any(len(indexes) != 0 for indexes in outstanding.values()):
+            blocked = set()
+            for _ in range(len(unsent)):
+                index = unsent.popleft()
+                if paths[index] not in blocked:
+                    try:
+                        self.socket.sendto(requests[index], paths[index])
+                        outstanding.setdefault(paths[index], deque()).append(index)
+                        continue
+                    except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):  # Not started or busy.
+                        blocked.add(paths[index])
+
+                unsent.append(index)
+
+            wait = None
+            if len(unsent) != 0:
+                wait = delay
+                delay = min(delay * 2, 0.2)
+
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+
+                wait = remaining if wait is None else min(wait, remaining)
+
+            if len(select((self.socket,), (), (), wait)[0]) != 0:
+                self.receive(outstanding, output, results)
+
+        for index, (vhost, _) in enumerate(commands):
+            if results[index] is None:
+                results[index] = (False, f"{vhost} did not reply." if index not in unsent else f"{vhost} is not running.")
+
+        return results
+
+    def receive(self, outstanding, output, results):
+        while True:
+            try:
+                reply, source = self.socket.recvfrom(REPLY.size)
+            except (BlockingIOError, InterruptedError):
+                return
+
+            indexes = outstanding.get(normpath(source))
+            if indexes is None or len(indexes) == 0:  # A late reply to an earlier batch.
+                continue
+
+            err, more, length, data = REPLY.unpack(reply.ljust(REPLY.size, b"\0"))
+            index = indexes[0]
+            output[index] = output.get(index, "") + data[:length].decode(errors="replace")
+
+            if not more:
+                indexes.popleft()
+                results[index] = (err == 0, output.pop(index))
+
+    def close(self):
+        self.socket.close()
+
+
+# Runs a single command on a machine and returns its output.
+def command(vhost, command_, timeout=None):
+    client = Mconsole()
+    try:
+        ok, output = client.batch(((vhost, command_),), timeout)[0]
+    finally:
+        client.close()
+
+    if not ok:
+        raise common.NetkitError(f"{vhost}: {output}")
+
+    return output
+
+
+def main(arguments=None):
+    parser = ArgumentParser(prog="mconsole", description="Sends a management console command to Netkit virtual machines.")
+
+    parser.add_argument("-t", "--timeout", default=5, type=float, metavar="SECONDS", dest="timeout")
+    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose")
+    parser.add_argument("-c", "--command", required=True, metavar="COMMAND", dest="command")
+    parser.add_argument(nargs="+", metavar="MACHINE-NAME", dest="vhosts")
+
+    arguments = parser.parse_args(args=arguments)
+
+    common.verbose(arguments.verbose)
+
+    client = Mconsole()
+    try:
+        results = client.batch([(vhost, arguments.command) for vhost in arguments.vhosts], arguments.timeout)
+    finally:
+        client.close()
+
+    for vhost, (ok, output) in zip(arguments.vhosts, results):
+        print(f"{vhost}: {'OK' if ok else 'ERR'} {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+from contextlib import contextmanager
+import os
+from pathlib import Path
+
+from . import common
+
+# Ensure the script is not being run independently.
+if __name__ == "__main__":
+    raise common.NetkitError("This script is not intended for standalone use.")
+
+POLICIES = ("none", "round-robin", "domain")
+
+
+# Parses a CPU list such as 0-3,8,10-11.
+def parse_cpu_list(string):
+    cpus = set()
+    for part in string.strip().split(","):
+        if part == "":
+            continue
+
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+
+    return cpus
+
+
+def format_cpu_list(cpus):
+    ranges = []
+    for cpu in sorted(cpus):
+        if len(ranges) != 0 and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def cpu_list(string):
+    try:
+        cpus = parse_cpu_list(string)
+    except ValueError:
+        raise common.NetkitError(f"{string} is not a valid CPU list.")
+
+    if len(cpus) == 0:
+        raise common.NetkitError("The CPU list is empty.")
+
+    return cpus
+
+
+def read_cpu_list(file):
+    try:
+        return parse_cpu_list(Path(file).read_text())
+    except (OSError, ValueError):
+        return set()
+
+
+# The CPUs of each NUMA node.
+def numa_nodes():
+    return [read_cpu_list(node / "cpulist") for node in sorted(Path("/sys/devices/system/node").glob("node[0-9]*"))]
+
+
+# The groups of CPUs sharing a last level cache.
+def cache_domains(cpus):
+    domains = []
+    for cpu in sorted(cpus):
+        caches = sorted(Path(f"/sys/devices/system/cpu/cpu{cpu}/cache").glob("index[0-9]*"))
+        domain = read_cpu_list(caches[-1] / "shared_cpu_list") if len(caches) != 0 else set()
+        if len(domain) != 0 and domain not in domains:
+            domains.append(domain)
+
+    return domains
+
+
+# Splits the CPUs into NUMA nodes, or groups sharing a last level cache, or a single cell.
+def cells(cpus):
+    for groups in (numa_nodes, lambda: cache_domains(cpus)):
+        groups = [group & cpus for group in groups()]
+        groups = [group for group in groups if len(group) != 0]
+        if len(groups) > 1:
+            return groups
+
+    return [set(cpus)]
+
+
+# The groups of machines connected to each other through their hubs, largest first.
+def collision_groups(hubs):
+    parents = {}
+
+    def find(node):
+        while parents.setdefault(node, node) != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    for vhost, vhost_hubs in hubs.items():
+        for hub in vhost_hubs:
+            parents[find(("hub", hub))] = find(("vhost", vhost))
+
+    groups = {}
+    for vhost in hubs:
+        groups.setdefault(find(("vhost", vhost)), []).append(vhost)
+
+    return sorted(groups.values(), key=len, reverse=True)
+
+
+# Places machines on the CPUs following a policy. Returns the reserved CPUs and the CPUs of each machine.
+def place(policy, hubs, reserve=0):
+    available = sorted(os.sched_getaffinity(0))
+    if reserve >= len(available):
+        raise common.NetkitError(f"Unable to reserve {reserve} of the {len(available)} available CPUs for the launcher.")
+
+    reserved = set(available[:reserve])
+    pool = available[reserve:]
+
+    vhost_cpus = {}
+    if policy == "round-robin":
+        for index, vhost in enumerate(hubs):
+            vhost_cpus[vhost] = {pool[index % len(pool)]}
+    elif policy == "domain":
+        cells_ = cells(set(pool))
+        load = [0] * len(cells_)
+        for group in collision_groups(hubs):
+            cell = min(range(len(cells_)), key=lambda index: (load[index] / len(cells_[index]), index))
+            load[cell] += len(group)
+            for vhost in group:
+                vhost_cpus[vhost] = cells_[cell]
+    else:
+        for vhost in hubs:
+            vhost_cpus[vhost] = set(pool)
+
+    return reserved, vhost_cpus
+
+
+# Each hub runs on the CPUs of the machines connected to it.
+def hub_cpus(hubs, vhost_cpus):
+    cpus = {}
+    for vhost, vhost_hubs in hubs.items():
+        for hub in vhost_hubs:
+            cpus.setdefault(hub, set()).update(vhost_cpus[vhost])
+
+    return cpus
+
+
+# Binds this thread to the given CPUs, if any, so the processes it starts inherit them.
+@contextmanager
+def pinned(cpus):
+    if cpus is None:
+        yield
+        return
+
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, cpus)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
@@ -1,59 +1,51 @@
-from contextlib import redirect_stderr, redirect_stdout
-from multiprocessing import Process
-from os import fork
+from socket import AF_UNIX, SOCK_STREAM, socket
+from subprocess import DEVNULL, Popen
+from sys import executable
+from threading import Thread
 from time import sleep
 
-from . import common
+from . import common, placement
 
 # Ensure the script is not being run independently.
 if __name__ == "__main__":
     raise common.NetkitError("This script is not intended for standalone use.")
 
 
-def run_command_(command):
-    # TODO
-    pass
-
-
-def run_command(command, arguments, background=True, silent=True):
+# Runs a command with a single fork and exec. Returns the process, or None if the command is only printed.
+def run_command(command, arguments, background=True, silent=True, cpus=None):
     if not arguments.quiet:
         print(f"Running command: {command}")
 
-    run_function(run_command_, (command,), background=background, silent=silent)
+    if arguments.print:
+        return None
 
+    stdio = DEVNULL if silent else None
+    with placement.pinned(cpus):
+        process = Popen(command, stdin=stdio, stdout=stdio, stderr=stdio, start_new_session=background)
 
-class MutedFunction:
-    def __init__(self, function):
-        self.function = function
+    if not background:
+        process.wait()
+    else:
+        common.launched_pids.add(process.pid)
 
-    def invoke(self, *args, **kwargs):
-        with redirect_stdout(None):
-            with redirect_stderr(None):
-                self.function(*args, **kwargs)
+    return process
 
 
-class DoubleForkedFunction:
-    def __init__(self, function):
-        self.function = function
+# Runs a Python function in a thread rather than a forked interpreter. A daemon thread doesn't keep the process alive.
+def run_function(function, args, silent=True, daemon=False):
+    def target():
+        try:
+            function(*args)
+        except Exception as e:
+            if not silent:
+                raise
 
-    def invoke(self, *args, **kwargs):
-        if fork() == 0:  # Child.
-            self.function(*args, **kwargs)
-        else:  # Parent.
-            return
+            common.logger.info(f"{function.__name__} failed: {e}")
 
+    thread = Thread(target=target, name=function.__name__, daemon=daemon)
+    thread.start()
 
-def run_function(function, args, background=True, silent=True):
-    if silent:
-        function = MutedFunction(function).invoke
-
-    if background:
-        function = DoubleForkedFunction(function).invoke
-        process = Process(target=function, args=args)
-        process.start()
-        process.join()
-    else:
-        function(*args)
+    return thread
 
 
 def run_inet_hub(hub, tap, guest, arguments):
@@ -61,18 +53,60 @@ def run_inet_hub(hub, tap, guest, arguments):
     pass
 
 
-def run_hub(hub, arguments):
+# Determines if a hub is running by connecting to its socket.
+def hub_ready(hub):
+    with socket(AF_UNIX, SOCK_STREAM) as socket_:
+        try:
+            socket_.connect(str(hub))
+        except OSError:
+            return False
+
+    return True
+
+
+def run_hub(hub, arguments, cpus=None):
     # TODO: Logging?
-    if not hub.is_socket() or not common.in_use(hub):
-        run_command(("uml_switch", "-hub", "-unix", hub), arguments)
+    if not hub_ready(hub):
+        if hub.is_socket():  # Left behind by a hub that is no longer running.
+            hub.unlink(missing_ok=True)
+
+        run_command(("uml_switch", "-hub", "-unix", hub), arguments, cpus=cpus)
 
-    while not arguments.print and not hub.is_socket():
-        sleep(1)
 
+# Waits for a hub to accept connections, backing off from a short initial delay.
+def wait_hub(hub, arguments):
+    delay = 0.01
+    while not arguments.print and not hub_ready(hub):
+        sleep(delay)
+        delay = min(delay * 2, 0.2)
 
-def run_hubs(hubs, arguments):
+
+# Starts all the hubs that are not running and then waits for them.
+def run_hubs(hubs, arguments, cpus=None):
+    cpus = {} if cpus is None else cpus
     for hub in hubs:
         if isinstance(hub, tuple):
             run_inet_hub(*hub, arguments)
         else:
-            run_hub(hub, arguments)
+            run_hub(hub, arguments, cpus.get(hub))
+
+    for hub in hubs:
+        if not isinstance(hub, tuple):
+            wait_hub(hub, arguments)
+
+
+# Starts all the hubs that are not running in a single switch daemon process.
+def run_switch_daemon(hubs, arguments, cpus=None):
+    daemon_hubs = []
+    for hub in hubs:
+        if isinstance(hub, tuple):
+            run_inet_hub(*hub, arguments)
+        elif not hub_ready(hub):
+            daemon_hubs.append(hub)
+
+    if len(daemon_hubs) != 0:
+        daemon_cpus = None if cpus is None else set().union(*(cpus.get(hub, ()) for hub in daemon_hubs)) or None
+        run_command((executable, "-m", "netkit_python.vswitch", *daemon_hubs), arguments, cpus=daemon_cpus)
+
+    for hub in daemon_hubs:
+        wait_hub(hub, arguments)
@@ -1,12 +1,15 @@
-from argparse import ArgumentParser, SUPPRESS
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from functools import lru_cache
 from ipaddress import AddressValueError, IPv4Address
 from os import getcwd
 from pathlib import Path
 from shlex import split
 from shutil import which
+from sys import argv, executable
+from threading import Event
 from time import sleep
 
-from . import common, vcommon
+from . import common, mconsole, placement, vcommon
 
 TERMINAL_APPLICATION_MAPPER = {
     "konsole-tab": "konsole",
@@ -23,7 +26,7 @@ TERMINAL_KERNEL_COMMAND_MAPPER = {
 
 TERMINAL_SETUP_MAPPER = {
     "konsole": "konsole,-T,-e",
-    "konsole-tab": f"""{common.netkit_home / "bin" / "konsole-tabs.sh"},-T,-e""",
+    "konsole-tab": "{netkit_home}/bin/konsole-tabs.sh,-T,-e",
     "gnome": "xterm=gnome-terminal,-t,-x",
 
 }
@@ -78,11 +81,9 @@ def file_system(argument):
 
 
 def interfaces(arguments, kernel_command):
-    if not arguments.quiet:
-        print("Interfaces:")
-
     enabled_default_route = False
     hubs = []
+    interfaces_ = []
     for interface, hub in arguments.interfaces:
         if hub == "tap":
             raise common.NetkitError("Invalid tap collision domain.")
@@ -104,8 +105,7 @@ def interfaces(arguments, kernel_command):
 
         socket = common.config["HUB_SOCKET_DIR"] / f"""{common.config["HUB_SOCKET_PREFIX"]}_{common.user_id}_{hub}{common.config["HUB_SOCKET_EXTENSION"]}"""
 
-        if not arguments.quiet:
-            print(f"  {interface}@{hub}: {socket}")
+        interfaces_.append((interface, hub, socket))
 
         kernel_command.append(f"{interface}=daemon,,,{socket}")
 
@@ -119,69 +119,196 @@ def interfaces(arguments, kernel_command):
         else:
             hubs.append(socket)
 
-    return hubs
+    return interfaces_, hubs
 
 
+# Any mconsole request wakes up the port helper. It is sent as soon as the machine's mconsole socket accepts it.
 def wake_up_port_helper_(arguments):
-    sleep(5)
-    vcommon.run_command(("uml_mconsole", arguments.vhost, "help"), background=True, silent=True)
+    mconsole.command(arguments.vhost, "help", timeout=60)
 
 
-def remove_file_system_(arguments):
+# Removes the file system once the kernel has created it, giving up if the kernel is no longer running.
+def remove_file_system_(arguments, running):
     while not arguments.file_system.is_file():
+        if not running():
+            return
+
         sleep(1)
 
     arguments.file_system.unlink()
 
 
-def run_kernel_command(kernel_command, wake_up_port_helper, remove_file_system, hubs, arguments):
-    if wake_up_port_helper:
-        vcommon.run_function(wake_up_port_helper_, (arguments,))
-
-    if remove_file_system:
-        vcommon.run_function(remove_file_system_, (arguments,))
-
-    vcommon.run_command(kernel_command, arguments, background=False, silent=False)
+# Runs the kernel and its helpers. Detached helpers outlive this process. Returns the process of a background kernel.
+def run_kernel_command(kernel_command, wake_up_port_helper, remove_file_system, hubs, arguments, background=True, silent=True, cpus=None, detach_helpers=True):
+    process = vcommon.run_command(kernel_command, arguments, background=True, silent=silent, cpus=cpus) if background else None
+    foreground_exited = Event()
 
+    if wake_up_port_helper and not arguments.print:
+        if background and detach_helpers:
+            vcommon.run_command((executable, "-m", "netkit_python.mconsole", "-t", "60", "-c", "help", arguments.vhost), arguments)
+        else:
+            vcommon.run_function(wake_up_port_helper_, (arguments,), daemon=True)
+
+    if remove_file_system and not arguments.print:
+        running = (lambda: process.poll() is None) if background else (lambda: not foreground_exited.is_set())
+        vcommon.run_function(remove_file_system_, (arguments, running))
+
+    if not background:
+        try:
+            vcommon.run_command(kernel_command, arguments, background=False, silent=silent, cpus=cpus)
+        finally:
+            foreground_exited.set()
+
+    return process
+
+
+# A default taken from the configuration once the arguments have been parsed.
+class ConfigDefault:
+    def __init__(self, key):
+        self.key = key
+
+
+def resolve_defaults(arguments):
+    for _, kwargs in options():
+        if isinstance(getattr(arguments, kwargs["dest"]), ConfigDefault):
+            setattr(arguments, kwargs["dest"], common.config[getattr(arguments, kwargs["dest"]).key])
+
+
+# The options of vstart as (flags, add_argument keyword arguments).
+@lru_cache(maxsize=None)
+def options():
+    return (
+        (("-k", "--kernel"), {"default": ConfigDefault("VM_KERNEL"), "type": common.resolved_file, "metavar": "FILENAME", "dest": "kernel"}),
+        (("-M", "--mem"), {"default": ConfigDefault("VM_MEMORY"), "type": memory, "metavar": "MEMORY", "dest": "memory"}),
+        (("-m", "--model-fs"), {"default": ConfigDefault("VM_MODEL_FS"), "type": model_file_system, "metavar": "MODEL-FILESYSTEM", "dest": "model_file_system"}),
+        (("-f", "--filesystem"), {"type": file_system, "metavar": "FILESYSTEM", "dest": "file_system"}),
+        (("--con0",), {"default": ConfigDefault("VM_CON0"), "type": common.optional, "metavar": "MODE", "dest": "con0"}),
+        (("--con1",), {"default": ConfigDefault("VM_CON1"), "type": common.optional, "metavar": "MODE", "dest": "con1"}),
+        (("-e", "--exec"), {"metavar": "COMMAND", "dest": "exec"}),
+        (("-l", "--hostlab"), {"type": common.resolved_directory, "metavar": "DIRECTORY", "dest": "host_lab"}),
+        (("-w", "--hostwd"), {"type": common.resolved_directory, "metavar": "DIRECTORY", "dest": "host_working_directory"}),
+        (("--append",), {"default": [], "type": split, "metavar": "PARAMETER", "dest": "append"}),
+        (("--tmux-attached",), {"action": "store_const", "const": True, "default": ConfigDefault("TMUX_OPEN_TERMS"), "dest": "tmux_open_terminals"}),
+        (("--tmux-detached",), {"action": "store_const", "const": False, "default": ConfigDefault("TMUX_OPEN_TERMS"), "dest": "tmux_open_terminals"}),
+        (("-F", "--foreground"), {"action": "store_true", "dest": "foreground"}),
+        (("-H", "--no-hosthome"), {"action": "store_true", "dest": "no_host_home"}),
+        (("-W", "--no-cow"), {"action": "store_true", "dest": "use_model_file_system"}),
+        (("-D", "--hide-disk-file"), {"action": "store_true", "dest": "remove_file_system"}),
+        (("--cpus",), {"type": placement.cpu_list, "metavar": "CPU-LIST", "dest": "cpus"}),
+        (("-q", "--quiet"), {"action": "store_true", "dest": "quiet"}),
+        (("-p", "--print"), {"action": "store_true", "dest": "print"}),
+        (("-v", "--verbose"), {"action": "store_true", "dest": "verbose"}),
+        (("--debug",), {"action": "store_true", "dest": "debug"}),
+        (("--xterm",), {"default": ConfigDefault("TERM_TYPE"), "choices": ("konsole", "konsole-tab", "gnome", "xterm", "alacritty", "kitty", "wsl", "wt"), "metavar": "TYPE", "dest": "terminal"}),
+        (("--version",), {"action": "store_true", "dest": "version"}),
+    )
+
+
+# The default arguments for a machine, as the command line parser would produce them.
+def default_arguments(vhost):
+    arguments = Namespace(vhost=vhost, interfaces=[])
+
+    for _, kwargs in options():
+        action = kwargs.get("action", "store")
+        default = kwargs.get("default", False if action == "store_true" else None)
+        setattr(arguments, kwargs["dest"], list(default) if isinstance(default, list) else default)
+
+    resolve_defaults(arguments)
+
+    return arguments
+
+
+# Applies a single vstart option, e.g. ("--mem", "64") or ("--eth0", "A"), to arguments without a command line parser.
+def apply_option(arguments, option, value=None):
+    if option.startswith("--eth") and option[5:].isdigit() and int(option[5:]) < common.config["MAX_INTERFACES"]:
+        arguments.interfaces.append(InterfaceType(option[2:]).invoke(value))
+        return
+
+    for flags, kwargs in options():
+        if option in flags:
+            break
+    else:
+        raise common.NetkitError(f"Unrecognised vstart option {option}.")
 
-def main(arguments=None):
-    parser = ArgumentParser(prog="lstart", description="The command used to start a Netkit virtual machine.")
-
-    # Matching arguments by prefix is not supported so we have to do something a little hacky.
-    parser.add_argument("--ethN", type=interface_error, metavar="DOMAIN", dest="dummy")
-    for i in range(common.config["MAX_INTERFACES"]):
-        parser.add_argument(f"--eth{i}", action="append", default=[], type=InterfaceType(f"eth{i}").invoke, help=SUPPRESS, dest="interfaces")
-
-    parser.add_argument("-k", "--kernel", default=common.config["VM_KERNEL"], type=common.resolved_file, metavar="FILENAME", dest="kernel")
-    parser.add_argument("-M", "--mem", default=common.config["VM_MEMORY"], type=memory, metavar="MEMORY", dest="memory")
-    parser.add_argument("-m", "--model-fs", default=common.config["VM_MODEL_FS"], type=model_file_system, metavar="MODEL-FILESYSTEM", dest="model_file_system")
-    parser.add_argument("-f", "--filesystem", type=file_system, metavar="FILESYSTEM", dest="file_system")
-    parser.add_argument("--con0", default=common.config["VM_CON0"], type=common.optional, metavar="MODE", dest="con0")
-    parser.add_argument("--con1", default=common.config["VM_CON1"], type=common.optional, metavar="MODE", dest="con1")
-    parser.add_argument("-e", "--exec", metavar="COMMAND", dest="exec")
-    parser.add_argument("-l", "--hostlab", type=common.resolved_directory, metavar="DIRECTORY", dest="host_lab")
-    parser.add_argument("-w", "--hostwd", type=common.resolved_directory, metavar="DIRECTORY", dest="host_working_directory")
-    parser.add_argument("--append", default=[], type=split, metavar="PARAMETER", dest="append")
-
-    tmux_group = parser.add_mutually_exclusive_group()
-    tmux_group.add_argument("--tmux-attached", action="store_const", const=True, default=common.config["TMUX_OPEN_TERMS"], dest="tmux_open_terminals")
-    tmux_group.add_argument("--tmux-detached", action="store_const", const=False, default=common.config["TMUX_OPEN_TERMS"], dest="tmux_open_terminals")
-
-    parser.add_argument("-F", "--foreground", action="store_true", dest="foreground")
-    parser.add_argument("-H", "--no-hosthome", action="store_true", dest="no_host_home")
-    parser.add_argument("-W", "--no-cow", action="store_true", dest="use_model_file_system")
-    parser.add_argument("-D", "--hide-disk-file", action="store_true", dest="remove_file_system")
-    parser.add_argument("-q", "--quiet", action="store_true", dest="quiet")
-    parser.add_argument("-p", "--print", action="store_true", dest="print")
-    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose")
-    parser.add_argument("--debug", action="store_true", dest="debug")
-    parser.add_argument("--xterm", default=common.config["TERM_TYPE"], choices=("konsole", "konsole-tab", "gnome", "xterm", "alacritty", "kitty", "wsl", "wt"), metavar="TYPE", dest="terminal")
-    parser.add_argument("--version", action="store_true", dest="version")
-    # TODO: Testing stuff.
-    parser.add_argument(metavar="MACHINE-NAME", dest="vhost")
-
-    arguments = parser.parse_args(args=arguments)
+    action = kwargs.get("action", "store")
+    if action == "store_true":
+        value = True
+    elif action == "store_const":
+        value = kwargs["const"]
+    else:
+        if value is None:
+            raise common.NetkitError(f"{option} requires an argument.")
 
+        if "type" in kwargs:
+            try:
+                value = kwargs["type"](value)
+            except (ArgumentTypeError, TypeError, ValueError):
+                raise common.NetkitError(f"Invalid argument {value!r} for {option} of {arguments.vhost}.") from None
+
+        if "choices" in kwargs and value not in kwargs["choices"]:
+            raise common.NetkitError(f"{option}'s argument must be one of: {', '.join(kwargs['choices'])}.")
+
+    setattr(arguments, kwargs["dest"], value)
+
+
+# Applies a list of vstart options, as they would appear on the command line, to arguments.
+def apply_options(arguments, options_):
+    options_ = list(reversed(options_))
+    while len(options_) != 0:
+        option = options_.pop()
+        value = None
+        if not option.startswith("--") and len(option) > 2 and option[2] != "=" and is_option(option[:2]):
+            # Like argparse, short options may have an attached value (-M64) and short flags may be combined (-HW).
+            if option_is_flag(option[:2]):
+                options_.append(f"-{option[2:]}")
+            else:
+                value = option[2:]
+
+            option = option[:2]
+        elif "=" in option:
+            option, value = option.split("=", 1)
+
+        if value is None and not option_is_flag(option):
+            value = options_.pop() if len(options_) != 0 else None
+
+        apply_option(arguments, option, value)
+
+
+def is_option(option):
+    return any(option in flags for flags, _ in options())
+
+
+def option_is_flag(option):
+    for flags, kwargs in options():
+        if option in flags:
+            return kwargs.get("action", "store") in ("store_true", "store_const")
+
+    return False
+
+
+# Everything needed to launch a machine. It is generated from arguments by spec without side effects.
+class LaunchSpec:
+    def __init__(self, vhost):
+        self.vhost = vhost
+        self.kernel = None
+        self.modules = None
+        self.memory = None
+        self.model_file_system = None
+        self.file_system = None
+        self.interfaces = []
+        self.hubs = []
+        self.con0 = None
+        self.con1 = None
+        self.kernel_command = []
+        self.background = True
+        self.silent = True
+        self.wake_up_port_helper = False
+        self.remove_file_system = False
+        self.cpus = None
+
+
+# Generates the launch spec for a machine from its arguments.
+def spec(arguments):
     if arguments.con0 == "this" and arguments.con1 == "this":
         raise common.NetkitError("Only one console can be attached to the current terminal.")
 
@@ -195,80 +322,54 @@ def main(arguments=None):
         if not (argument in ("xterm", "this", "pty", None) or argument.startswith("port:")):
             raise common.NetkitError("Unrecognised con device.")
 
-    common.verbose(arguments.verbose)
-
-    common.logger.info(f"vstart arguments: {arguments}")
-
-    if arguments.con0 == "xterm" or arguments.con1 == "xterm" or (arguments.con0 == "tmux" and arguments.tmux_open_terminals):
-        terminal_application = arguments.terminal
-
-        if terminal_application in TERMINAL_APPLICATION_MAPPER:
-            terminal_application = TERMINAL_APPLICATION_MAPPER[terminal_application]
-
-        if which(terminal_application) is None:
-            raise common.NetkitError("The specified terminal application was not found. Please install it.")
+    spec_ = LaunchSpec(arguments.vhost)
+    spec_.kernel = arguments.kernel
+    spec_.memory = arguments.memory
+    spec_.model_file_system = arguments.model_file_system
+    spec_.file_system = arguments.file_system
+    spec_.con0 = arguments.con0
+    spec_.con1 = arguments.con1
 
-    if arguments.file_system is None:
-        arguments.file_system = common.resolved_directory(getcwd()) / f"{arguments.vhost}.disk"
+    if spec_.file_system is None:
+        spec_.file_system = common.resolved_directory(getcwd()) / f"{arguments.vhost}.disk"
 
     kernel_command = [arguments.kernel]
 
     # TODO: File system checking.
 
-    if not arguments.quiet:
-        print(f"Starting: {arguments.vhost}")
-        print(f"Kernel: {arguments.kernel}")
-
     modules = arguments.kernel.parent / "modules"
     if modules.is_dir():
         kernel_command.append(f"modules={modules}")
-        if not arguments.quiet:
-            print(f"Modules: {modules}")
+        spec_.modules = modules
 
     kernel_command.append(f"name={arguments.vhost}")
     kernel_command.append(f"title={arguments.vhost}")
     kernel_command.append(f"umid={arguments.vhost}")
+    kernel_command.append(f"""uml_dir={common.config["MCONSOLE_DIR"]}""")
 
     kernel_command.append(f"""mem={arguments.memory + common.config["VM_MEMORY_SKEW"]}M""")
-    print(f"Memory: {arguments.memory}")
 
     if arguments.use_model_file_system:
         kernel_command.append(f"ubd0={arguments.model_file_system}")
-        arguments.file_system = arguments.model_file_system
+        spec_.file_system = arguments.model_file_system
     else:
-        kernel_command.append(f"ubd0={arguments.file_system},{arguments.model_file_system}")
-
-    if not arguments.quiet:
-        print(f"Model file system: {arguments.model_file_system}")
-        print(f"File system: {arguments.file_system}")
+        kernel_command.append(f"ubd0={spec_.file_system},{arguments.model_file_system}")
 
     kernel_command.append("root=98:0")
 
-    hubs = interfaces(arguments, kernel_command)
+    spec_.interfaces, spec_.hubs = interfaces(arguments, kernel_command)
 
     if not arguments.no_host_home:
         kernel_command.append(f"hosthome={common.home}")
 
-    if not arguments.print and common.pid(arguments.vhost, common.user_id) is not None:
-        raise common.NetkitError(f"{arguments.vhost} is already running.")
-
-    if not arguments.print and common.in_use(arguments.file_system):
-        raise common.NetkitError(f"The file system is being used by another process.")
-
     if arguments.exec is not None:
         kernel_command.append(f"exec=\"{arguments.exec}\"")
-        if not arguments.quiet:
-            print(f"Boot command: {arguments.exec}")
 
     if arguments.host_lab is not None:
         kernel_command.append(f"hostlab={arguments.host_lab}")
-        if not arguments.quiet:
-            print(f"Host lab: {arguments.host_lab}")
 
     if arguments.host_working_directory is not None:
         kernel_command.append(f"hostwd={arguments.host_working_directory}")
-        if not arguments.quiet:
-            print(f"Host working directory: {arguments.host_working_directory}")
 
     if arguments.debug:
         kernel_command.insert(0, "--args")
@@ -276,10 +377,10 @@ def main(arguments=None):
     elif not arguments.verbose:
         kernel_command.append("quiet")
 
-    if arguments.con0 == "xterm" and not common.config["CON0_PORTHELPER"]:
-        arguments.con0 = "this_noporthelper"
+    if spec_.con0 == "xterm" and not common.config["CON0_PORTHELPER"]:
+        spec_.con0 = "this_noporthelper"
 
-    for con, argument in zip(("con0", "con1"), (arguments.con0, arguments.con1)):
+    for con, argument in zip(("con0", "con1"), (spec_.con0, spec_.con1)):
         terminal_kernel_command = argument
 
         if terminal_kernel_command in TERMINAL_KERNEL_COMMAND_MAPPER:
@@ -290,35 +391,154 @@ def main(arguments=None):
     kernel_command.append("SELINUX_INIT=0")
 
     if arguments.terminal in TERMINAL_SETUP_MAPPER:
-        kernel_command.append(f"xterm={TERMINAL_SETUP_MAPPER[arguments.terminal]}")
+        kernel_command.append(f"xterm={TERMINAL_SETUP_MAPPER[arguments.terminal].format(netkit_home=common.netkit_home)}")
 
     kernel_command += arguments.append
-    if len(arguments.append ) > 0 and not arguments.quiet:
-        print(f"Additional arguments: {arguments.append}")
 
-    if arguments.con0 in ("xterm", "this_noporthelper"):
+    if spec_.con0 in ("xterm", "this_noporthelper"):
         kernel_command.insert(0, arguments.vhost)
         kernel_command.insert(0, arguments.terminal)
         kernel_command.insert(0, common.netkit_home / "bin" / "block-wrapper")  # TODO: Use a block wrapper script.
 
-    if arguments.con0 == "tmux":
-        if which("tmux") is None:
-            raise common.NetkitError("tmux is not installed.")
-
+    if spec_.con0 == "tmux":
         kernel_command.insert(0, arguments.vhost)
         kernel_command.insert(0, "tmux")
         kernel_command.insert(0, common.netkit_home / "bin" / "block-wrapper")  # TODO: Use a block wrapper script.
 
-    vcommon.run_hubs(hubs, arguments)
+    spec_.kernel_command = kernel_command
+    spec_.background = not arguments.foreground and spec_.con0 != "this" and spec_.con1 != "this"
+    spec_.silent = spec_.con0 is None
+    spec_.wake_up_port_helper = common.config["CON0_PORTHELPER"]
+    spec_.remove_file_system = arguments.remove_file_system
+    spec_.cpus = arguments.cpus
+
+    return spec_
+
+
+def print_spec(spec_, arguments):
+    if not arguments.quiet:
+        print(f"Starting: {spec_.vhost}")
+        print(f"Kernel: {spec_.kernel}")
+
+        if spec_.modules is not None:
+            print(f"Modules: {spec_.modules}")
+
+    print(f"Memory: {spec_.memory}")
+
+    if not arguments.quiet:
+        print(f"Model file system: {spec_.model_file_system}")
+        print(f"File system: {spec_.file_system}")
+
+        if spec_.cpus is not None:
+            print(f"CPUs: {placement.format_cpu_list(spec_.cpus)}")
+
+        print("Interfaces:")
+        for interface, hub, socket in spec_.interfaces:
+            print(f"  {interface}@{hub}: {socket}")
+
+        if arguments.exec is not None:
+            print(f"Boot command: {arguments.exec}")
+
+        if arguments.host_lab is not None:
+            print(f"Host lab: {arguments.host_lab}")
+
+        if arguments.host_working_directory is not None:
+            print(f"Host working directory: {arguments.host_working_directory}")
+
+        if len(arguments.append) > 0:
+            print(f"Additional arguments: {arguments.append}")
+
+
+# Checks that the machine can be launched on this host.
+def check(spec_, arguments, snapshot=None):
+    if spec_.con0 in ("xterm", "this_noporthelper") or spec_.con1 == "xterm" or (spec_.con0 == "tmux" and arguments.tmux_open_terminals):
+        terminal_application = arguments.terminal
+
+        if terminal_application in TERMINAL_APPLICATION_MAPPER:
+            terminal_application = TERMINAL_APPLICATION_MAPPER[terminal_application]
+
+        if which(terminal_application) is None:
+            raise common.NetkitError("The specified terminal application was not found. Please install it.")
+
+    if spec_.con0 == "tmux" and which("tmux") is None:
+        raise common.NetkitError("tmux is not installed.")
+
+    if arguments.print:
+        return
+
+    # Both checks use one refresh of /proc, unless the caller gives a snapshot it keeps up to date.
+    if snapshot is None:
+        snapshot = common.proc_snapshot()
+
+    if common.pid(spec_.vhost, common.user_id, snapshot) is not None:
+        raise common.NetkitError(f"{spec_.vhost} is already running.")
+
+    if common.in_use(spec_.file_system, snapshot):
+        raise common.NetkitError(f"The file system is being used by another process.")
+
+
+# Starts the hubs and the kernel of a machine. Returns the kernel's process if it runs in the background.
+def launch(spec_, arguments, hubs=True, snapshot=None, detach_helpers=True):
+    check(spec_, arguments, snapshot)
+
+    if hubs:
+        vcommon.run_hubs(spec_.hubs, arguments, None if spec_.cpus is None else {hub: spec_.cpus for hub in spec_.hubs if not isinstance(hub, tuple)})
+
+    arguments.file_system = spec_.file_system
+
+    return run_kernel_command(spec_.kernel_command, spec_.wake_up_port_helper, spec_.remove_file_system, spec_.hubs, arguments, background=spec_.background, silent=spec_.silent, cpus=spec_.cpus, detach_helpers=detach_helpers)
+
+
+# Matching arguments by prefix is not supported, so the --ethN options are taken out before parsing.
+def split_interface_options(arguments):
+    remaining = []
+    interface_options = []
+    arguments = iter(arguments)
+    for argument in arguments:
+        option, _, value = argument.partition("=")
+        if option.startswith("--eth") and option[5:].isdigit():
+            if "=" not in argument:
+                value = next(arguments, None)
+                if value is None:
+                    raise common.NetkitError(f"{option} requires an argument.")
+
+            interface_options.append((option, value))
+        else:
+            remaining.append(argument)
+
+    return remaining, interface_options
+
+
+def main(arguments=None):
+    parser = ArgumentParser(prog="lstart", description="The command used to start a Netkit virtual machine.")
+
+    parser.add_argument("--ethN", type=interface_error, metavar="DOMAIN", dest="dummy")
+
+    for flags, kwargs in options():
+        parser.add_argument(*flags, **kwargs)
+
+    # TODO: Testing stuff.
+    parser.add_argument(metavar="MACHINE-NAME", dest="vhost")
+
+    arguments, interface_options = split_interface_options(argv[1:] if arguments is None else arguments)
+    arguments = parser.parse_args(args=arguments)
+
+    resolve_defaults(arguments)
+
+    arguments.interfaces = []
+    for option, value in interface_options:
+        apply_option(arguments, option, value)
+
+    common.verbose(arguments.verbose)
+
+    common.logger.info(f"vstart arguments: {arguments}")
 
-    background = not arguments.foreground and arguments.con0 != "this" and arguments.con1 != "this"
-    silent = arguments.con0 is None
-    wake_up_port_helper = common.config["CON0_PORTHELPER"]
-    remove_file_system = arguments.remove_file_system
+    spec_ = spec(arguments)
 
-    print(kernel_command)
+    print_spec(spec_, arguments)
+    print(spec_.kernel_command)
 
-    vcommon.run_function(run_kernel_command, (kernel_command, wake_up_port_helper, remove_file_system, hubs, arguments), background=background, silent=silent)
+    launch(spec_, arguments)
 
 
 if __name__ == "__main__":
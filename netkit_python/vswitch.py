@@ -0,0 +1,260 @@
+from argparse import ArgumentParser
+from asyncio import get_event_loop, run, start_unix_server
+from os import getpid
+from pathlib import Path
+from signal import SIGINT, SIGTERM, SIGUSR1
+from socket import AF_UNIX, SOCK_DGRAM, SOCK_STREAM, socket, timeout
+from struct import Struct
+from time import perf_counter
+
+from . import common
+
+# The uml_switch control protocol, as spoken by the UML daemon transport.
+SWITCH_MAGIC = 0xfeedface
+SWITCH_VERSION = 3
+REQ_NEW_CONTROL = 0
+
+SOCKADDR_UN = Struct("=H108s")  # struct sockaddr_un { sa_family_t sun_family; char sun_path[108]; }
+REQUEST_V3 = Struct(f"=III{SOCKADDR_UN.size}s2x")  # Padded to the alignment of the C struct.
+
+MAX_FRAME = 65536
+
+
+# Converts a sun_path to a socket module address. Abstract addresses use the full length of sun_path.
+def address(sun_path):
+    if sun_path.startswith(b"\0"):
+        return sun_path
+
+    return sun_path.split(b"\0", 1)[0].decode(errors="surrogateescape")
+
+
+def sun_path(address_):
+    if isinstance(address_, str):
+        address_ = address_.encode(errors="surrogateescape")
+
+    return address_.ljust(108, b"\0")
+
+
+def abstract_address(name):
+    return sun_path(b"\0" + name.encode())
+
+
+# A collision domain served by the daemon. Every frame received from a port is forwarded to all other ports.
+class Domain:
+    def __init__(self, hub, index):
+        self.hub = hub
+        self.ports = {}  # address -> control connection
+        self.data = socket(AF_UNIX, SOCK_DGRAM)
+        self.data.setblocking(False)
+        self.data.bind(abstract_address(f"vswitch-{getpid()}-{index}"))
+        self.server = None
+
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.dropped = 0
+        self.unknown = 0
+
+    async def start(self):
+        if self.hub.is_socket():
+            self.hub.unlink()
+
+        self.server = await start_unix_server(self.control, path=str(self.hub))
+        get_event_loop().add_reader(self.data.fileno(), self.forward)
+
+    async def control(self, reader, writer):
+        port = None
+        try:
+            request = await reader.readexactly(REQUEST_V3.size - 2)
+            magic, version, type_, sock = REQUEST_V3.unpack(request + b"\0\0")
+            if magic != SWITCH_MAGIC or version != SWITCH_VERSION or type_ != REQ_NEW_CONTROL:
+                common.logger.warning(f"{self.hub}: Rejecting a request with an unsupported version or type.")
+                return
+
+            port = address(SOCKADDR_UN.unpack(sock)[1])
+            self.ports[port] = writer
+            common.logger.info(f"{self.hub}: New port {port!r}.")
+
+            writer.write(SOCKADDR_UN.pack(AF_UNIX, self.data.getsockname()))
+            await writer.drain()
+
+            # The port lives as long as its control connection.
+            while len(await reader.read(4096)) != 0:
+                pass
+        except (ConnectionError, EOFError, OSError):
+            pass
+        finally:
+            if port is not None and self.ports.get(port) is writer:
+                del self.ports[port]
+                common.logger.info(f"{self.hub}: Port {port!r} disconnected.")
+
+            writer.close()
+
+    # Drains every pending frame and then forwards the batch, so a wakeup is shared by all the frames that arrived.
+    def forward(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.data.recvfrom(MAX_FRAME))
+            except (BlockingIOError, InterruptedError):
+                break
+
+        for frame, source in batch:
+            if source not in self.ports:
+                self.unknown += 1
+                continue
+
+            self.frames_in += 1
+            self.bytes_in += len(frame)
+
+            for port in self.ports:
+                if port != source:
+                    try:
+                        self.data.sendto(frame, port)
+                        self.frames_out += 1
+                    except OSError:  # The port's buffer is full or the port has gone away.
+                        self.dropped += 1
+
+    def statistics(self):
+        return {"ports": len(self.ports), "frames_in": self.frames_in, "bytes_in": self.bytes_in, "frames_out": self.frames_out, "dropped": self.dropped, "unknown": self.unknown}
+
+    def close(self):
+        get_event_loop().remove_reader(self.data.fileno())
+        self.data.close()
+
+        if self.server is not None:
+            self.server.close()
+
+        self.hub.unlink(missing_ok=True)
+
+
+# Serves many hub sockets from a single process. Statistics are printed on SIGUSR1 and on exit.
+class SwitchDaemon:
+    def __init__(self, hubs):
+        self.domains = [Domain(hub, index) for index, hub in enumerate(hubs)]
+
+    def print_statistics(self):
+        for domain in self.domains:
+            print(f"{domain.hub}: {domain.statistics()}", flush=True)
+
+    async def serve(self):
+        loop = get_event_loop()
+        stop = loop.create_future()
+
+        for signal in (SIGINT, SIGTERM):
+            loop.add_signal_handler(signal, lambda: stop.done() or stop.set_result(None))
+        loop.add_signal_handler(SIGUSR1, self.print_statistics)
+
+        try:
+            for domain in self.domains:
+                await domain.start()
+
+            await stop
+        finally:
+            self.print_statistics()
+
+            for domain in self.domains:
+                domain.close()
+
+
+# A client of a hub, behaving like the UML daemon transport. It is used to test and benchmark hubs.
+class HubClient:
+    def __init__(self, hub, name):
+        self.control = socket(AF_UNIX, SOCK_STREAM)
+        self.control.connect(str(hub))
+
+        self.data = socket(AF_UNIX, SOCK_DGRAM)
+        self.data.bind(abstract_address(f"vswitch-client-{getpid()}-{name}"))
+
+        self.control.sendall(REQUEST_V3.pack(SWITCH_MAGIC, SWITCH_VERSION, REQ_NEW_CONTROL, SOCKADDR_UN.pack(AF_UNIX, self.data.getsockname())))
+
+        reply = b""
+        while len(reply) < SOCKADDR_UN.size:
+            received = self.control.recv(SOCKADDR_UN.size - len(reply))
+            if len(received) == 0:
+                raise common.NetkitError(f"{hub} closed the connection.")
+            reply += received
+
+        self.switch = address(SOCKADDR_UN.unpack(reply)[1])
+
+    def send(self, frame):
+        self.data.sendto(frame, self.switch)
+
+    def receive(self, timeout=None):
+        self.data.settimeout(timeout)
+        return self.data.recv(MAX_FRAME)
+
+    def close(self):
+        self.control.close()
+        self.data.close()
+
+
+# Measures the throughput and round trip latency of a hub.
+def benchmark(hub, frames=10000, size=1514, window=8):
+    sender = HubClient(hub, "sender")
+    receiver = HubClient(hub, "receiver")
+    frame = bytes(size)
+
+    try:
+        # Throughput: keep a window of frames in flight. Frames that don't arrive within a second are counted as lost.
+        received = 0
+        lost = 0
+        start = perf_counter()
+        for sent in range(1, frames + 1):
+            sender.send(frame)
+            while sent - received - lost > (window if sent < frames else 0):
+                try:
+                    receiver.receive(1)
+                    received += 1
+                except timeout:
+                    lost = sent - received
+        throughput = received / (perf_counter() - start)
+
+        # Latency: one frame at a time, there and back again.
+        round_trips = []
+        for _ in range(min(frames, 1000)):
+            start = perf_counter()
+            try:
+                sender.send(frame)
+                receiver.receive(1)
+                receiver.send(frame)
+                sender.receive(1)
+            except timeout:
+                continue
+            round_trips.append(perf_counter() - start)
+        round_trips.sort()
+    finally:
+        sender.close()
+        receiver.close()
+
+    return {
+        "frames_per_second": round(throughput),
+        "megabits_per_second": round(throughput * size * 8 / 1e6, 1),
+        "lost": lost,
+        "round_trip_median_us": round(round_trips[len(round_trips) // 2] * 1e6, 1) if len(round_trips) != 0 else None,
+        "round_trip_p99_us": round(round_trips[int(len(round_trips) * 0.99)] * 1e6, 1) if len(round_trips) != 0 else None,
+    }
+
+
+def main(arguments=None):
+    parser = ArgumentParser(prog="vswitch", description="A hub daemon serving many Netkit collision domains from one process.")
+
+    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose")
+    parser.add_argument("--benchmark", action="store_true", dest="benchmark")
+    parser.add_argument("--frames", default=10000, type=common.unsigned_integer, metavar="FRAMES", dest="frames")
+    parser.add_argument("--size", default=1514, type=common.unsigned_integer, metavar="BYTES", dest="size")
+    parser.add_argument(nargs="+", type=Path, metavar="HUB-SOCKET", dest="hubs")
+
+    arguments = parser.parse_args(args=arguments)
+
+    common.verbose(arguments.verbose)
+
+    if arguments.benchmark:
+        for hub in arguments.hubs:
+            print(f"{hub}: {benchmark(hub, arguments.frames, arguments.size)}")
+    else:
+        run(SwitchDaemon(arguments.hubs).serve())
+
+
+if __name__ == "__main__":
+    main()
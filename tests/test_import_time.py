@@ -0,0 +1,16 @@
+from unittest import TestCase, main
+
+from netkit_python import lbenchmark
+
+
+# Importing a command must stay within the budget, as it is paid by every invocation, including --help.
+class ImportTimeTest(TestCase):
+    def test_import_time(self):
+        for cli in lbenchmark.CLIS:
+            with self.subTest(cli=cli):
+                import_time = lbenchmark.import_time(cli)
+                self.assertLess(import_time, lbenchmark.IMPORT_BUDGET, f"Importing netkit_python.{cli} took {import_time:.1f} ms.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+from pathlib import Path
+from socket import AF_UNIX, SOCK_DGRAM, socket
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from netkit_python import common, mconsole
+
+
+# A machine's management console, which replies to "help" in two parts and rejects any other command.
+def serve(server, requests):
+    for _ in range(requests):
+        data, source = server.recvfrom(mconsole.REQUEST.size)
+        _, _, length, command = mconsole.REQUEST.unpack(data)
+        if command[:length] == b"help":
+            server.sendto(mconsole.REPLY.pack(0, 1, 5, b"help "), source)
+            server.sendto(mconsole.REPLY.pack(0, 0, 4, b"text"), source)
+        else:
+            server.sendto(mconsole.REPLY.pack(1, 0, 7, b"unknown"), source)
+
+
+class MconsoleTest(TestCase):
+    def test_batch(self):
+        with TemporaryDirectory() as directory, patch.dict(common.config.converted, {"MCONSOLE_DIR": Path(directory)}):
+            (Path(directory) / "pc1").mkdir()
+            with socket(AF_UNIX, SOCK_DGRAM) as server:
+                server.bind(str(mconsole.socket_path("pc1")))
+                thread = Thread(target=serve, args=(server, 2), daemon=True)
+                thread.start()
+
+                client = mconsole.Mconsole()
+                try:
+                    results = client.batch([("pc1", "help"), ("pc1", "reboot"), ("pc2", "help")], timeout=1)
+                finally:
+                    client.close()
+                thread.join(1)
+
+        self.assertEqual(results, [(True, "help text"), (False, "unknown"), (False, "pc2 is not running.")])
+
+
+if __name__ == "__main__":
+    main()